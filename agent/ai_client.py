@@ -0,0 +1,35 @@
+"""
+Anthropic client shared by the cart-building path (the job worker's query
+rewrite and WalmartAgent's product selection).
+
+Created on first use, over an HTTP/2 connection pool so concurrent Haiku calls
+multiplex over one TLS session instead of each opening their own.
+close_ai_client() releases it on shutdown.
+"""
+
+import os
+
+import anthropic
+import httpx
+
+_client: anthropic.AsyncAnthropic | None = None
+
+
+def ai_client() -> anthropic.AsyncAnthropic:
+    global _client
+    if _client is None:
+        _client = anthropic.AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY", ""),
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=8),
+            ),
+        )
+    return _client
+
+
+async def close_ai_client() -> None:
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.close()
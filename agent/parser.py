@@ -24,7 +24,7 @@ _UNIT_WORDS = {
 # Price constraint pattern: (max $8), max $8, under $10, up to $5, at most $3
 _PRICE_PAT = re.compile(
     r"\(?\s*(?:max(?:imum)?|under|up\s+to|at\s+most)\s*:?\s*\$?([\d.]+)\s*\)?",
-    re.IGNORECASE,
+    re.IGNORECASE | re.ASCII,
 )
 
 # Explicit brand pattern: brand:indomie  or  (brand: Dempster's)
@@ -34,13 +34,17 @@ _BRAND_PAT = re.compile(
 )
 
 # Qty suffix: " x2", " X3", " ×4" at end of string
-_QTY_SUFFIX = re.compile(r"\s+[xX×](\d+)$")
+_QTY_SUFFIX = re.compile(r"\s+[xX×](\d+)$", re.ASCII)
 
 # Qty prefix: "2x ", "3X ", "2 x " at start
-_QTY_PREFIX = re.compile(r"^(\d+)\s*[xX×]\s+(.+)$")
+_QTY_PREFIX = re.compile(r"^(\d+)\s*[xX×]\s+(.+)$", re.ASCII)
 
 # Bare trailing integer: "milk 2" — only treated as qty if not preceded by a unit word
-_QTY_BARE = re.compile(r"\s+(\d+)$")
+_QTY_BARE = re.compile(r"\s+(\d+)$", re.ASCII)
+
+# Whitespace runs (collapsed to one space) and the item separators
+_WS = re.compile(r"\s+")
+_SPLIT = re.compile(r"[\n,]+")
 
 
 def parse_item(raw: str) -> dict:
@@ -65,13 +69,13 @@ def parse_item(raw: str) -> dict:
     m = _PRICE_PAT.search(s)
     if m:
         max_price = float(m.group(1))
-        s = re.sub(r"\s+", " ", s[: m.start()] + " " + s[m.end() :]).strip()
+        s = _WS.sub(" ", s[: m.start()] + " " + s[m.end() :]).strip()
 
     # ── 2. Extract explicit brand ─────────────────────────────────────────────
     m = _BRAND_PAT.search(s)
     if m:
         brand = m.group(1).strip()
-        s = re.sub(r"\s+", " ", s[: m.start()] + " " + s[m.end() :]).strip()
+        s = _WS.sub(" ", s[: m.start()] + " " + s[m.end() :]).strip()
 
     # ── 3. Extract quantity ───────────────────────────────────────────────────
     # Priority: "x2" suffix > "2x" prefix > bare trailing integer
@@ -96,7 +100,7 @@ def parse_item(raw: str) -> dict:
                 s = preceding
 
     # ── 4. Normalise name ─────────────────────────────────────────────────────
-    name = re.sub(r"\s+", " ", s).strip(" ,()[]")
+    name = _WS.sub(" ", s).strip(" ,()[]")
 
     return {
         "name": name,
@@ -112,7 +116,7 @@ def parse_items(text: str) -> list[dict]:
     Skips blank lines and lines starting with '/'.
     """
     items = []
-    for raw in re.split(r"[\n,]+", text):
+    for raw in _SPLIT.split(text):
         raw = raw.strip()
         if not raw or raw.startswith("/"):
             continue
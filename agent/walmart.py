@@ -2,7 +2,9 @@
 Walmart.ca browser automation via Playwright.
 
 Classes:
-    WalmartAgent   – headless cart-building worker (used by job worker)
+    WalmartAgent   – headless cart-building worker (used by job worker); runs
+                     in its own context on a shared browser, see
+                     close_shared_browsers()
     WalmartLinker  – headful manual-login helper (used by /link command)
 """
 
@@ -11,9 +13,9 @@ import json
 import logging
 import os
 import random
+import re
 from pathlib import Path
 
-import anthropic
 from playwright.async_api import (
     async_playwright,
     Browser,
@@ -22,14 +24,15 @@ from playwright.async_api import (
     TimeoutError as PWTimeout,
 )
 
-logger = logging.getLogger(__name__)
+from agent.ai_client import ai_client
 
-_ai_client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY", ""))
+logger = logging.getLogger(__name__)
 
 SESSION_PATH: str = os.getenv("SESSION_PATH", "sessions/walmart_session.json")
 HEADLESS: bool = os.getenv("HEADLESS", "true").lower() == "true"
 WALMART_BASE = "https://www.walmart.ca"
 SCREENSHOT_DIR = Path("storage/screenshots")
+_screenshot_dir_ready = False   # created on the first capture, not at import
 
 # Akamai / PerimeterX cookies that track visitor identity and get flagged.
 # Stripping them before each headless run lets Akamai see a fresh visitor
@@ -94,14 +97,26 @@ def merge_phone_cookies(cookie_string: str, session_path: str = SESSION_PATH) ->
     return updated
 
 
+# path → (mtime_ns, cleaned storage_state). Saves go through storage_state(path=...)
+# which bumps the mtime, so a stale entry is never served.
+_SESSION_CACHE: dict[str, tuple[int, dict]] = {}
+
+
 def _clean_session(path: str) -> dict:
     """
     Load a saved Playwright storage_state JSON and strip Akamai/PerimeterX
     tracking cookies so each headless run starts with a fresh bot-detection
     identity while preserving Walmart auth cookies.
+
+    The cleaned state is cached until the file changes on disk; callers must
+    treat the returned dict as read-only.
     """
-    import json as _json
-    data = _json.loads(Path(path).read_text())
+    mtime = os.stat(path).st_mtime_ns
+    cached = _SESSION_CACHE.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    data = json.loads(Path(path).read_text())
     before = len(data.get("cookies", []))
     data["cookies"] = [
         c for c in data.get("cookies", [])
@@ -113,6 +128,7 @@ def _clean_session(path: str) -> dict:
             "Stripped tracking cookies from session",
             extra={"removed": before - after, "kept": after},
         )
+    _SESSION_CACHE[path] = (mtime, data)
     return data
 
 _USER_AGENT = (
@@ -193,6 +209,15 @@ _ADD_TO_CART = [
     'button:has-text("Add to Cart")',
 ]
 
+_OVERLAY_CLOSE = [
+    'button[aria-label="Close"]',
+    'button[aria-label="close"]',
+    '[data-automation-id="close-modal"]',
+    'button:has-text("Continue shopping")',
+    'button:has-text("No thanks")',
+    '[data-automation-id="modal-close-btn"]',
+]
+
 _LOGGED_IN_INDICATORS = [
     '[data-automation-id="account-menu"]',
     'a[href*="/account/"]',
@@ -202,6 +227,32 @@ _LOGGED_IN_INDICATORS = [
 ]
 
 
+# Phrases that appear in the title, URL or first few KB of a block/CAPTCHA page
+_BOT_RE = re.compile(
+    r"access denied|robot check|captcha|unusual traffic|verify you are human|"
+    r"checking your browser|ddos-guard|please enable cookies|"
+    r"sorry, you have been blocked|403 forbidden|just a moment",
+    re.IGNORECASE,
+)
+
+
+_CAPTCHA_SELECTORS = ['iframe[src*="captcha"]', 'iframe[src*="recaptcha"]', '[id*="captcha"]']
+
+# Returns everything _check_bot_challenge needs in one evaluate() call
+_CHALLENGE_PROBE_JS = """
+(captchaSels) => {
+    const root = document.documentElement;
+    return {
+        title:   document.title || '',
+        snippet: root ? root.outerHTML.slice(0, 3000) : '',
+        captcha: captchaSels.find((s) => {
+            try { return !!document.querySelector(s); } catch (e) { return false; }
+        }) || null,
+    };
+}
+"""
+
+
 class BotChallengeError(Exception):
     """Raised when Walmart presents a bot-detection or CAPTCHA page."""
 
@@ -251,8 +302,10 @@ async def _human_type(page: Page, locator, text: str) -> None:
     """Click field and type each character with randomised inter-key delay."""
     await _human_click(page, locator)
     await asyncio.sleep(random.uniform(0.2, 0.5))
-    for char in text:
-        await page.keyboard.type(char, delay=random.randint(60, 160))
+    # Draw every inter-key delay up front so the typing loop is just an iterator
+    delays = random.choices(range(60, 161), k=len(text))
+    for char, delay in zip(text, delays):
+        await page.keyboard.type(char, delay=delay)
 
 
 async def _random_scroll(page: Page) -> None:
@@ -268,48 +321,35 @@ async def _random_scroll(page: Page) -> None:
 
 async def _check_bot_challenge(page: Page) -> None:
     await asyncio.sleep(0.4)
-    title = (await page.title()).lower()
-    url = page.url.lower()
+    # Title, HTML head and CAPTCHA probes in a single driver round-trip
     try:
-        snippet = (await page.content())[:3000].lower()
+        probe = await page.evaluate(_CHALLENGE_PROBE_JS, _CAPTCHA_SELECTORS)
     except Exception:
-        snippet = ""
+        probe = {"title": await page.title(), "snippet": "", "captcha": None}
 
-    triggers = [
-        "access denied", "robot check", "captcha", "unusual traffic",
-        "verify you are human", "checking your browser", "ddos-guard",
-        "please enable cookies", "sorry, you have been blocked",
-        "403 forbidden", "just a moment",
-    ]
-    combined = f"{title} {url} {snippet}"
-    for t in triggers:
-        if t in combined:
-            raise BotChallengeError(f"Bot challenge detected ({t!r}) at {page.url}")
+    # One case-insensitive scan instead of lowering each source and testing every phrase
+    m = _BOT_RE.search(f"{probe['title']} {page.url} {probe['snippet']}")
+    if m:
+        raise BotChallengeError(
+            f"Bot challenge detected ({m.group(0).lower()!r}) at {page.url}"
+        )
 
-    for sel in ['iframe[src*="captcha"]', 'iframe[src*="recaptcha"]', '[id*="captcha"]']:
-        try:
-            if await page.locator(sel).count() > 0:
-                raise BotChallengeError(f"CAPTCHA element found ({sel})")
-        except BotChallengeError:
-            raise
-        except Exception:
-            pass
+    if probe["captcha"]:
+        raise BotChallengeError(f"CAPTCHA element found ({probe['captcha']})")
 
 
 async def _dismiss_overlays(page: Page) -> None:
-    for sel in [
-        'button[aria-label="Close"]',
-        'button[aria-label="close"]',
-        '[data-automation-id="close-modal"]',
-        'button:has-text("Continue shopping")',
-        'button:has-text("No thanks")',
-        '[data-automation-id="modal-close-btn"]',
-    ]:
+    # Probe every selector in one batch — each is an independent driver round-trip
+    locs = [page.locator(sel).first for sel in _OVERLAY_CLOSE]
+    visible = await asyncio.gather(
+        *(loc.is_visible() for loc in locs), return_exceptions=True
+    )
+    for loc, vis in zip(locs, visible):
+        if vis is not True:
+            continue
         try:
-            el = page.locator(sel).first
-            if await el.is_visible():
-                await _human_click(page, el)
-                await asyncio.sleep(random.uniform(0.3, 0.6))
+            await _human_click(page, loc)
+            await asyncio.sleep(random.uniform(0.3, 0.6))
         except Exception:
             pass
 
@@ -469,7 +509,7 @@ async def _ai_select_product(
     )
 
     try:
-        resp = await _ai_client.messages.create(
+        resp = await ai_client().messages.create(
             model="claude-haiku-4-5-20251001",
             max_tokens=8,
             messages=[{"role": "user", "content": prompt}],
@@ -483,6 +523,49 @@ async def _ai_select_product(
     return None
 
 
+# ── Shared headless browser ────────────────────────────────────────────────────
+
+# One Firefox process per headless setting, shared by every WalmartAgent. Each
+# agent still opens its own BrowserContext (separate cookies and storage), so
+# jobs stay isolated; only the multi-second browser launch is shared.
+_shared_browsers: dict[bool, tuple] = {}   # headless → (playwright, browser)
+_shared_lock = asyncio.Lock()
+
+
+async def _shared_browser(headless: bool) -> Browser:
+    """Return the shared browser, launching it (again, if it died) as needed."""
+    async with _shared_lock:
+        entry = _shared_browsers.pop(headless, None)
+        if entry is not None:
+            if entry[1].is_connected():
+                _shared_browsers[headless] = entry
+                return entry[1]
+            await entry[0].stop()
+
+        pw = await async_playwright().start()
+        try:
+            # Firefox: different TLS fingerprint that Akamai doesn't block
+            browser = await pw.firefox.launch(headless=headless, args=_STEALTH_ARGS)
+        except BaseException:
+            await pw.stop()
+            raise
+        _shared_browsers[headless] = (pw, browser)
+        logger.info("Shared browser launched", extra={"headless": headless})
+        return browser
+
+
+async def close_shared_browsers() -> None:
+    """Close the shared browsers; called on app shutdown."""
+    async with _shared_lock:
+        entries = list(_shared_browsers.values())
+        _shared_browsers.clear()
+    for pw, browser in entries:
+        try:
+            await browser.close()
+        finally:
+            await pw.stop()
+
+
 # ── WalmartAgent ───────────────────────────────────────────────────────────────
 
 class WalmartAgent:
@@ -497,20 +580,13 @@ class WalmartAgent:
     def __init__(self, postal_code: str = "", headless: bool = HEADLESS):
         self.postal_code = postal_code
         self.headless = headless
-        self._pw = None
-        self._browser: Browser | None = None
         self._context: BrowserContext | None = None
         self.page: Page | None = None
         # Set by build_cart if a screenshot is taken on failure
         self.last_screenshot: str | None = None
 
     async def __aenter__(self) -> "WalmartAgent":
-        self._pw = await async_playwright().start()
-        self._browser = await self._pw.firefox.launch(
-            headless=self.headless,
-            # Firefox: different TLS fingerprint that Akamai doesn't block
-            args=_STEALTH_ARGS,
-        )
+        browser = await _shared_browser(self.headless)
         ctx_kwargs: dict = {
             "viewport": {"width": 1280, "height": 900},
             "user_agent": _USER_AGENT,
@@ -535,16 +611,19 @@ class WalmartAgent:
             logger.info("Loaded Walmart session (tracking cookies stripped)",
                         extra={"session": SESSION_PATH})
 
-        self._context = await self._browser.new_context(**ctx_kwargs)
-        await self._context.add_init_script(_STEALTH_SCRIPT)
-        self.page = await self._context.new_page()
+        self._context = await browser.new_context(**ctx_kwargs)
+        try:
+            await self._context.add_init_script(_STEALTH_SCRIPT)
+            self.page = await self._context.new_page()
+        except BaseException:
+            await self._context.close()
+            raise
         return self
 
     async def __aexit__(self, *_) -> None:
-        if self._browser:
-            await self._browser.close()
-        if self._pw:
-            await self._pw.stop()
+        # The browser is shared; only this agent's context goes away
+        if self._context:
+            await self._context.close()
 
     # ── Private helpers ────────────────────────────────────────────────────────
 
@@ -555,11 +634,16 @@ class WalmartAgent:
         await _dismiss_overlays(self.page)
 
     async def _safe_screenshot(self, job_id: str) -> str | None:
-        """Capture current page to storage/screenshots/{job_id}.png. Never raises."""
+        """Capture current page to storage/screenshots/{job_id}.jpg. Never raises."""
+        global _screenshot_dir_ready
         try:
-            SCREENSHOT_DIR.mkdir(parents=True, exist_ok=True)
-            path = SCREENSHOT_DIR / f"{job_id}.png"
-            await self.page.screenshot(path=str(path), full_page=False)
+            if not _screenshot_dir_ready:
+                await asyncio.to_thread(SCREENSHOT_DIR.mkdir, parents=True, exist_ok=True)
+                _screenshot_dir_ready = True
+            path = SCREENSHOT_DIR / f"{job_id}.jpg"
+            # JPEG is a fraction of the PNG size for UI captures; write off the event loop
+            buf = await self.page.screenshot(full_page=False, type="jpeg", quality=70)
+            await asyncio.to_thread(path.write_bytes, buf)
             logger.info("Screenshot saved", extra={"path": str(path), "job_id": job_id})
             return str(path)
         except Exception as exc:
@@ -615,6 +699,17 @@ class WalmartAgent:
         except Exception as exc:
             logger.warning("Could not set postal code", extra={"error": str(exc)})
 
+    async def _open_product(self, url: str) -> None:
+        """
+        Navigate to a product page, overlapping the human dwell delay with
+        the DOM load instead of running them back to back.
+        """
+        await self.page.goto(url, wait_until="commit", timeout=30000)
+        await asyncio.gather(
+            self.page.wait_for_load_state("domcontentloaded", timeout=30000),
+            _delay(1.5, 2.8),
+        )
+
     async def _try_add_from_page(self) -> bool:
         for sel in _ADD_TO_CART:
             btns = self.page.locator(sel)
@@ -702,10 +797,7 @@ class WalmartAgent:
 
                     if product_url:
                         await _short_delay()
-                        await self.page.goto(
-                            product_url, wait_until="domcontentloaded", timeout=30000
-                        )
-                        await _delay(1.5, 2.8)
+                        await self._open_product(product_url)
                         await self._check()
                         await _random_scroll(self.page)
                         if await self._try_add_from_page():
@@ -734,10 +826,7 @@ class WalmartAgent:
                     if href:
                         product_url = href if href.startswith("http") else WALMART_BASE + href
                         await _short_delay()
-                        await self.page.goto(
-                            product_url, wait_until="domcontentloaded", timeout=30000
-                        )
-                        await _delay(1.5, 2.8)
+                        await self._open_product(product_url)
                         await self._check()
                         await _random_scroll(self.page)
                         if await self._try_add_from_page():
@@ -6,21 +6,22 @@ so the user can chat naturally instead of memorising commands.
 """
 
 import asyncio
-import json
 import logging
 import os
 import re
-import uuid
+from collections import OrderedDict, deque
 
 import anthropic
+import orjson
 
 from agent.parser import parse_items
 from db.database import (
     add_items as db_add_items,
     clear_items as db_clear_items,
-    create_job,
-    get_chat,
+    get_chat_and_items,
+    get_history,
     get_items,
+    save_history,
     upsert_chat,
 )
 
@@ -28,10 +29,21 @@ logger = logging.getLogger(__name__)
 
 _client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY", ""))
 
-# Per-chat conversation history (in-memory; resets on server restart)
-_histories: dict[int, list] = {}
+# Per-chat conversation history lives in SQLite (db.get_history / save_history)
+# so it survives restarts and is shared by every process; capped at this many
+# messages and expired after a day of inactivity.
 _MAX_HISTORY = 20
 
+# Output budgets per turn. The first turn is usually just a tool_use block and
+# the turn after tool results a 1–3 sentence reply; a turn that hits its budget
+# is re-run once at _MAX_TOKENS.
+_MAX_TOOL_TOKENS  = 256
+_MAX_REPLY_TOKENS = 400
+_MAX_TOKENS       = 512
+
+# chat_id → (items_version, rendered list summary) for the per-turn system context
+_summary_cache: dict[int, tuple[int, str]] = {}
+
 _SYSTEM = """\
 You are a grocery shopping assistant for Walmart.ca Canada. \
 Your job is to manage the user's grocery list and build their cart.
@@ -55,7 +67,43 @@ STRICT RULES — follow every one of these exactly:
 9. Do NOT suggest adding extra items unless the user explicitly asks for recommendations.
 """
 
-_TOOLS = [
+# Exact trigger phrases from rules 4 and 5 — handled locally, no model round-trip
+_INTENT_RE = re.compile(
+    r"^\s*(?:"
+    r"(?P<build_cart>go|shop|checkout|order|build(?: my)? cart|run it|do it|start shopping)"
+    r"|(?P<clear_list>clear|reset|start over|new list|remove everything)"
+    r")\s*[.!?]?\s*$",
+    re.IGNORECASE,
+)
+
+# Postal codes: drop spaces/dashes in one pass, then require the A1A1A1 shape
+_POSTAL_TABLE = str.maketrans("", "", " \t\u00a0-")
+_CA_POSTAL_RE = re.compile(r"^[A-Z]\d[A-Z]\d[A-Z]\d$")
+
+
+def normalize_postal_code(raw: str) -> str | None:
+    """*raw* as a bare uppercase Canadian postal code (M5V3A1), or None if it isn't one."""
+    postal = raw.translate(_POSTAL_TABLE).upper()
+    return postal if _CA_POSTAL_RE.match(postal) else None
+
+# Tools that change chat state. A turn's writes run before its reads, and take
+# a per-chat lock so writes to the same chat apply one at a time, in order.
+_WRITE_TOOLS = frozenset({"add_to_list", "clear_list", "build_cart", "set_location"})
+_write_locks: dict[int, asyncio.Lock] = {}
+_write_waiters: dict[int, int] = {}
+
+# One turn at a time per chat; entries are dropped when no turn holds or awaits them
+_chat_locks: dict[int, asyncio.Lock] = {}
+_chat_waiters: dict[int, int] = {}
+
+# Static prefix, identical on every turn so Anthropic can serve it from the
+# prompt cache. Tools sit ahead of the system prompt in the cache prefix, so
+# this one breakpoint covers the tool schemas as well.
+_SYSTEM_BLOCK = {"type": "text", "text": _SYSTEM, "cache_control": {"type": "ephemeral"}}
+
+# Frozen module constant: the same object is handed to every messages.create
+# call, so the serialized schema is byte-identical and stays on the cached prefix.
+_TOOLS = (
     {
         "name": "add_to_list",
         "description": (
@@ -113,48 +161,143 @@ _TOOLS = [
             "required": ["postal_code"],
         },
     },
-]
+)
+
+
+# Natural-language quantities the regex parser can't handle ("a dozen eggs",
+# "3 packs of indomie", "two bags of rice"); only these need the Haiku parser.
+_NL_QTY_RE = re.compile(
+    r"\b(?:a|an|half|dozen|couple|few|packs?|bags?|bunch(?:es)?|of"
+    r"|one|two|three|four|five|six|seven|eight|nine|ten)\b",
+    re.IGNORECASE,
+)
+
+# Haiku parses keyed on the normalized raw string ("a dozen eggs"); LRU-bounded
+_parse_cache: OrderedDict[str, dict] = OrderedDict()
+_PARSE_CACHE_SIZE = 2048
+
+
+# Fixed Haiku parse instructions; only the item list changes per call
+_PARSE_SYSTEM = [{
+    "type": "text",
+    "text": (
+        "Parse grocery shopping items into structured data by calling emit_parsed.\n"
+        "Quantities: convert language — "
+        '"a dozen"=12, "half dozen"=6, "a"=1, "a pack"=1, "a bag"=1, '
+        '"a couple"=2, "a few"=3; default=1.\n'
+        "IMPORTANT: Only include items that appear in the input. Do not add extras.\n"
+        "Example input: [\"3 packs indomie chicken\", \"a dozen eggs\", \"2L milk max $5\"]\n"
+        'Example items: [{"name":"indomie chicken noodles","qty":3,"brand":"Indomie","max_price":null},'
+        '{"name":"eggs","qty":12,"brand":null,"max_price":null},'
+        '{"name":"milk 2L","qty":1,"brand":null,"max_price":5.0}]'
+    ),
+    "cache_control": {"type": "ephemeral"},
+}]
+
+# Forced tool call — the model returns the parse as schema-checked tool input
+_PARSE_TOOL = {
+    "name": "emit_parsed",
+    "description": "Return the parsed shopping items, one per input item.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "items": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {
+                            "type": "string",
+                            "description": "Concise product name good for searching on Walmart.ca",
+                        },
+                        "qty": {"type": "integer", "minimum": 1},
+                        "brand": {
+                            "type": ["string", "null"],
+                            "description": "Brand if explicitly stated, otherwise null",
+                        },
+                        "max_price": {
+                            "type": ["number", "null"],
+                            "description": 'Price cap if stated (e.g. "max $5" → 5.0), otherwise null',
+                        },
+                    },
+                    "required": ["name", "qty"],
+                },
+            }
+        },
+        "required": ["items"],
+    },
+}
 
 
 async def _ai_parse_items(raw_items: list[str]) -> list[dict]:
+    """
+    Parse raw item strings into structured dicts, in input order.
+
+    Plain items ("eggs", "2x milk", "bread (max $4)") go through the regex
+    parser inline; only items with natural-language quantities are sent to
+    Claude Haiku, so most add_to_list calls make no API request at all.
+    """
+    parsed: list[list[dict]] = []
+    hard: list[int] = []
+    for i, raw in enumerate(raw_items):
+        if _NL_QTY_RE.search(raw):
+            hard.append(i)
+            parsed.append([])
+        else:
+            parsed.append(parse_items(raw))
+
+    misses: list[int] = []
+    for i in hard:
+        key = raw_items[i].strip().lower()
+        hit = _parse_cache.get(key)
+        if hit is None:
+            misses.append(i)
+        else:
+            _parse_cache.move_to_end(key)
+            parsed[i] = [dict(hit)]
+
+    if misses:
+        ai_items = await _haiku_parse_items([raw_items[i] for i in misses])
+        if ai_items is None:
+            for i in misses:
+                parsed[i] = parse_items(raw_items[i])
+        elif len(ai_items) == len(misses):
+            for i, item in zip(misses, ai_items):
+                parsed[i] = [item]
+                _parse_cache[raw_items[i].strip().lower()] = dict(item)
+            while len(_parse_cache) > _PARSE_CACHE_SIZE:
+                _parse_cache.popitem(last=False)
+        else:
+            # Model merged or split items — keep its batch where the first one was
+            parsed[misses[0]] = ai_items
+
+    return [item for group in parsed for item in group]
+
+
+async def _haiku_parse_items(raw_items: list[str]) -> list[dict] | None:
     """
     Use Claude Haiku to parse raw item strings into structured dicts.
 
     Handles natural language quantities ("a dozen", "3 packs of", "half a dozen")
-    that the regex parser cannot. Falls back to regex on any failure.
+    that the regex parser cannot. Returns None on any failure so the caller
+    can fall back to regex (and not cache the fallback).
     """
     if not raw_items:
         return []
 
-    prompt = (
-        "Parse these grocery shopping items into structured data.\n"
-        "Return ONLY a JSON array — no explanation, no markdown.\n\n"
-        "Items to parse: " + json.dumps(raw_items) + "\n\n"
-        "For each item, output an object with:\n"
-        '  "name": concise product name good for searching on Walmart.ca (string)\n'
-        '  "qty": integer quantity — convert language: '
-        '"a dozen"=12, "half dozen"=6, "a"=1, "a pack"=1, "a bag"=1, '
-        '"a couple"=2, "a few"=3; default=1\n'
-        '  "brand": brand name if explicitly stated, otherwise null\n'
-        '  "max_price": numeric price cap if stated (e.g. "max $5" → 5.0), otherwise null\n\n'
-        "IMPORTANT: Only include items that appear in the input. Do not add extras.\n"
-        "Example input: [\"3 packs indomie chicken\", \"a dozen eggs\", \"2L milk max $5\"]\n"
-        'Example output: [{"name":"indomie chicken noodles","qty":3,"brand":"Indomie","max_price":null},'
-        '{"name":"eggs","qty":12,"brand":null,"max_price":null},'
-        '{"name":"milk 2L","qty":1,"brand":null,"max_price":5.0}]\n\n'
-        "Now parse:"
-    )
-
     try:
         resp = await _client.messages.create(
             model="claude-haiku-4-5-20251001",
             max_tokens=512,
-            messages=[{"role": "user", "content": prompt}],
+            system=_PARSE_SYSTEM,
+            tools=[_PARSE_TOOL],
+            tool_choice={"type": "tool", "name": "emit_parsed"},
+            messages=[{
+                "role": "user",
+                "content": "Items to parse: " + orjson.dumps(raw_items).decode(),
+            }],
         )
-        text = resp.content[0].text.strip()
-        # Strip markdown code fences if present
-        text = re.sub(r"^```[a-z]*\n?", "", text).rstrip("`").strip()
-        parsed = json.loads(text)
+        parsed = next(b.input for b in resp.content if b.type == "tool_use")["items"]
 
         result = []
         for item in parsed:
@@ -175,52 +318,96 @@ async def _ai_parse_items(raw_items: list[str]) -> list[dict]:
     except Exception as exc:
         logger.warning("AI item parse failed, falling back to regex",
                        extra={"error": str(exc)})
-        result = []
-        for raw in raw_items:
-            result.extend(parse_items(raw))
-        return result
+        return None
 
 
 async def handle_message(
     chat_id: int,
     text: str,
     send_fn,        # async (text: str) -> None
-    trigger_job_fn, # async (job_id: str) -> None
+    trigger_job_fn, # async () -> (job_id: str, started: bool)
 ) -> None:
     """
     Process a free-form message and reply conversationally.
 
     send_fn       — sends a text reply to the user.
-    trigger_job_fn — called with a new job_id when the user wants to build the cart.
+    trigger_job_fn — starts a cart build unless one is already in flight, and
+                     returns that build's job id and whether it is new.
+
+    Messages from the same chat are handled one at a time, in arrival order,
+    so each turn sees the history and list the previous one left behind.
     """
-    history = _histories.setdefault(chat_id, [])
+    lock = _chat_locks.get(chat_id)
+    if lock is None:
+        lock = _chat_locks[chat_id] = asyncio.Lock()
+    _chat_waiters[chat_id] = _chat_waiters.get(chat_id, 0) + 1
+    try:
+        async with lock:
+            await _handle_turn(chat_id, text, send_fn, trigger_job_fn)
+    finally:
+        _chat_waiters[chat_id] -= 1
+        if not _chat_waiters[chat_id]:
+            # Last user of this lock — drop it so idle chats don't accumulate
+            del _chat_waiters[chat_id]
+            del _chat_locks[chat_id]
+
+
+async def _handle_turn(chat_id: int, text: str, send_fn, trigger_job_fn) -> None:
+    # deque(maxlen) drops the oldest messages on append — no re-slicing per turn
+    history = deque(await get_history(chat_id), maxlen=_MAX_HISTORY)
     history.append({"role": "user", "content": text})
 
+    # Bare "go" / "clear" style commands map to exactly one tool call
+    intent = _INTENT_RE.match(text)
+    if intent:
+        reply = await _dispatch_tool(intent.lastgroup, {}, chat_id, None, trigger_job_fn)
+        logger.info("Intent shortcut", extra={"tool": intent.lastgroup, "result": reply[:120]})
+        await send_fn(reply)
+        history.append({"role": "assistant", "content": reply})
+        await save_history(chat_id, list(history))
+        return
+
     # Build context-aware system prompt
-    chat = await get_chat(chat_id)
+    # Items are only fetched and re-rendered when the list changed since last turn
+    cached = _summary_cache.get(chat_id)
+    chat, rows = await get_chat_and_items(chat_id, cached[0] if cached else None)
     postal = chat["postal_code"] if chat else "not set"
     mode   = chat["mode"]        if chat else "delivery"
-    rows   = await get_items(chat_id)
-    list_summary = (
-        ", ".join(f"{r['qty']}x {r['text']}" for r in rows) if rows else "empty"
-    )
-    system = (
-        f"{_SYSTEM}\n\n"
-        f"User's current list: {list_summary}\n"
-        f"Postal code: {postal} | Mode: {mode}"
-    )
+    if chat and cached and cached[0] == chat["items_version"]:
+        list_summary = cached[1]
+    else:
+        list_summary = (
+            ", ".join(f"{r['qty']}x {r['text']}" for r in rows) if rows else "empty"
+        )
+        if chat:
+            _summary_cache[chat_id] = (chat["items_version"], list_summary)
+    # Per-turn context goes in a separate, uncached block after the static prefix
+    system = [
+        _SYSTEM_BLOCK,
+        {
+            "type": "text",
+            "text": (
+                f"User's current list: {list_summary}\n"
+                f"Postal code: {postal} | Mode: {mode}"
+            ),
+        },
+    ]
 
     messages = list(history)
+    # Trimming can leave an orphaned assistant turn or tool_result at the front;
+    # the conversation must open with a plain user message.
+    while messages[0]["role"] != "user" or not isinstance(messages[0]["content"], str):
+        messages.pop(0)
+    start = len(messages)
 
     # Agentic tool loop
+    max_tokens = _MAX_TOOL_TOKENS
     while True:
-        response = await _client.messages.create(
-            model="claude-sonnet-4-6",
-            max_tokens=512,
-            system=system,
-            tools=_TOOLS,
-            messages=messages,
-        )
+        response, list_rows = await _stream_turn(chat_id, system, messages, max_tokens)
+        if response.stop_reason == "max_tokens" and max_tokens < _MAX_TOKENS:
+            if list_rows is not None:
+                list_rows.cancel()
+            response, list_rows = await _stream_turn(chat_id, system, messages, _MAX_TOKENS)
 
         tool_calls  = [b for b in response.content if b.type == "tool_use"]
         text_blocks = [b.text for b in response.content if hasattr(b, "text") and b.text]
@@ -229,14 +416,28 @@ async def handle_message(
             reply = " ".join(text_blocks).strip()
             if reply:
                 await send_fn(reply)
-            history.append({"role": "assistant", "content": response.content})
+            messages.append({"role": "assistant", "content": _dump_blocks(response.content)})
             break
 
-        messages.append({"role": "assistant", "content": response.content})
-
+        messages.append({"role": "assistant", "content": _dump_blocks(response.content)})
+
+        # Writes go first, then the reads run concurrently, so get_list reports
+        # the list as this turn's add/clear calls left it
+        results = [""] * len(tool_calls)
+        writes = [i for i, tc in enumerate(tool_calls) if tc.name in _WRITE_TOOLS]
+        reads  = [i for i, tc in enumerate(tool_calls) if tc.name not in _WRITE_TOOLS]
+        for batch in (writes, reads):
+            done = await asyncio.gather(*(
+                _dispatch_tool(
+                    tool_calls[i].name, tool_calls[i].input,
+                    chat_id, chat, trigger_job_fn, list_rows,
+                )
+                for i in batch
+            ))
+            for i, result in zip(batch, done):
+                results[i] = result
         tool_results = []
-        for tc in tool_calls:
-            result = await _run_tool(tc.name, tc.input, chat_id, trigger_job_fn)
+        for tc, result in zip(tool_calls, results):
             logger.info("Tool called", extra={"tool": tc.name, "result": result[:120]})
             tool_results.append({
                 "type": "tool_result",
@@ -245,19 +446,107 @@ async def handle_message(
             })
 
         messages.append({"role": "user", "content": tool_results})
+        max_tokens = _MAX_REPLY_TOKENS
 
-    _histories[chat_id] = messages[-_MAX_HISTORY:]
+    history.extend(messages[start:])
+    await save_history(chat_id, list(history))
+
+
+async def _stream_turn(chat_id: int, system: list, messages: list, max_tokens: int):
+    """
+    Run one model turn over the streaming API.
+
+    As soon as a get_list tool_use block opens, the list fetch starts in the
+    background so it overlaps with the rest of the generation. A turn that
+    also calls a write tool gets no prefetch, since get_list must see the
+    writes. Returns the final message and that fetch task (or None).
+    """
+    list_rows: asyncio.Task | None = None
+    wrote = False
+    try:
+        async with _client.messages.stream(
+            model="claude-sonnet-4-6",
+            max_tokens=max_tokens,
+            system=system,
+            tools=_TOOLS,
+            messages=_with_cache_marker(messages),
+        ) as stream:
+            async for event in stream:
+                if event.type != "content_block_start" or event.content_block.type != "tool_use":
+                    continue
+                if event.content_block.name in _WRITE_TOOLS:
+                    wrote = True
+                    if list_rows is not None:
+                        list_rows.cancel()
+                        list_rows = None
+                elif event.content_block.name == "get_list" and list_rows is None and not wrote:
+                    list_rows = asyncio.create_task(get_items(chat_id))
+            response = await stream.get_final_message()
+    except BaseException:
+        if list_rows is not None:
+            list_rows.cancel()
+        raise
+    return response, list_rows
+
+
+def _with_cache_marker(messages: list[dict]) -> list[dict]:
+    """
+    Copy of *messages* with a prompt-cache breakpoint on the newest block.
+
+    Each tool-loop round then reads the previous round's prefix from cache and
+    is billed only for the delta. The stored history is never marked.
+    """
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = [*content[:-1], dict(content[-1])]
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return [*messages[:-1], {"role": last["role"], "content": blocks}]
+
+
+def _dump_blocks(blocks) -> list[dict]:
+    """Convert SDK content blocks into JSON-serializable message params."""
+    return [b.model_dump(exclude_none=True) for b in blocks]
+
+
+async def _dispatch_tool(
+    name: str,
+    inputs: dict,
+    chat_id: int,
+    chat: dict | None,
+    trigger_job_fn,
+    list_rows: asyncio.Task | None = None,
+) -> str:
+    """Run a tool, serializing state-changing tools per chat."""
+    if name not in _WRITE_TOOLS:
+        return await _run_tool(name, inputs, chat_id, chat, trigger_job_fn, list_rows)
+    lock = _write_locks.get(chat_id)
+    if lock is None:
+        lock = _write_locks[chat_id] = asyncio.Lock()
+    _write_waiters[chat_id] = _write_waiters.get(chat_id, 0) + 1
+    try:
+        async with lock:
+            return await _run_tool(name, inputs, chat_id, chat, trigger_job_fn)
+    finally:
+        _write_waiters[chat_id] -= 1
+        if not _write_waiters[chat_id]:
+            del _write_waiters[chat_id]
+            del _write_locks[chat_id]
 
 
 async def _run_tool(
     name: str,
     inputs: dict,
     chat_id: int,
+    chat: dict | None,      # chat row loaded at the start of the turn
     trigger_job_fn,
+    list_rows: asyncio.Task | None = None,  # get_items prefetched while streaming
 ) -> str:
     try:
         if name == "get_list":
-            rows = await get_items(chat_id)
+            rows = await list_rows if list_rows is not None else await get_items(chat_id)
             if not rows:
                 return "Shopping list is empty."
             lines = []
@@ -276,8 +565,6 @@ async def _run_tool(
             parsed = await _ai_parse_items(raw_items)
             if not parsed:
                 return "Couldn't parse any items from the input."
-            if not await get_chat(chat_id):
-                await upsert_chat(chat_id)
             await db_add_items(chat_id, parsed)
             labels = [f"{p['qty']}x {p['name']}" for p in parsed]
             return f"Added: {', '.join(labels)}"
@@ -290,16 +577,18 @@ async def _run_tool(
             rows = await get_items(chat_id)
             if not rows:
                 return "The shopping list is empty — nothing to build."
-            job_id = str(uuid.uuid4())[:8]
-            await create_job(job_id, chat_id)
-            await trigger_job_fn(job_id)
+            job_id, started = await trigger_job_fn()
+            if not started:
+                return f"A cart build is already running (job {job_id}). I'll message you when it's ready."
             return f"Cart build started (job {job_id}). I'll message you when it's ready."
 
         elif name == "set_location":
-            postal = inputs.get("postal_code", "").upper().replace(" ", "")
+            raw = inputs.get("postal_code", "")
+            postal = normalize_postal_code(raw)
+            if postal is None:
+                return f"'{raw}' is not a valid Canadian postal code (e.g. M5V3A1)."
             mode   = inputs.get("mode", "delivery")
-            existing = await get_chat(chat_id)
-            store    = existing["store"] if existing else ""
+            store  = chat["store"] if chat else ""
             await upsert_chat(chat_id, mode=mode, postal_code=postal, store=store)
             return f"Location saved: {postal}, {mode}."
 
@@ -0,0 +1,31 @@
+"""
+Base URL of the phone-solve page, shared by the API and the Telegram bot.
+"""
+
+import functools
+import os
+import socket
+
+
+@functools.lru_cache(maxsize=1)
+def _local_ip() -> str:
+    """Return the Mac's local network IP (e.g. 192.168.x.x), looked up once."""
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))
+        ip = s.getsockname()[0]
+        s.close()
+        return ip
+    except Exception:
+        return "localhost"
+
+
+def get_phone_solve_base() -> str:
+    """
+    Returns the base URL for the phone-solve page.
+    Priority:
+      1. PHONE_SOLVE_URL env var (e.g. an ngrok HTTPS URL)
+      2. Mac's local IP at port 8000 (works when phone is on same WiFi)
+    """
+    override = os.getenv("PHONE_SOLVE_URL", "").strip()
+    return (override or f"http://{_local_ip()}:8000").rstrip("/")
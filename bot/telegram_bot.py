@@ -1,5 +1,6 @@
 """
-Telegram bot — long-polling entry point.
+Telegram bot — handlers and app factory; main.py runs it by long polling or,
+with TELEGRAM_MODE=webhook, by feeding it updates pushed to /telegram/webhook.
 
 Commands:
     /start | /help          show help
@@ -17,13 +18,28 @@ Commands:
 """
 
 import asyncio
+import functools
+import hashlib
 import logging
 import os
-import socket
-import uuid
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from pathlib import Path
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import orjson
+from telegram import (
+    Bot,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputFile,
+    LinkPreviewOptions,
+    Update,
+)
+from telegram.constants import ParseMode
+from telegram.error import TelegramError
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
@@ -32,55 +48,183 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
+from telegram.request import HTTPXRequest
 
 from agent.parser import parse_items
-from agent.walmart import WalmartLinker, WalmartResumeSession
-from bot.ai_handler import handle_message as ai_handle
+from agent.walmart import SCREENSHOT_DIR, WalmartLinker, WalmartResumeSession
+from bot.ai_handler import handle_message as ai_handle, normalize_postal_code
+from bot.phone_solve import get_phone_solve_base
 from db.database import (
     add_items,
     clear_items,
     create_job,
     get_chat,
+    get_chat_and_items,
     get_items,
     get_job,
     update_job,
     upsert_chat,
 )
+from models.job import is_job_id
 from agent.walmart import merge_phone_cookies
-from workers.job_worker import process_job, register_callback, schedule_job
+from workers.job_worker import register_callback, schedule_job, set_default_callback
 
 logger = logging.getLogger(__name__)
 
 TELEGRAM_BOT_TOKEN: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
 SESSION_PATH: str = os.getenv("SESSION_PATH", "sessions/walmart_session.json")
 
-# In-memory map of chat_id → active WalmartLinker (for /link flow)
-_link_sessions: dict[int, WalmartLinker] = {}
+# Short, stable id for this bot so in-process state keyed by chat or job can't
+# collide with another bot's sharing the process (or, later, a shared cache)
+BOT_ID: str = hashlib.blake2b(TELEGRAM_BOT_TOKEN.encode(), digest_size=8).hexdigest()
 
-# In-memory map of job_id → active WalmartResumeSession (for /resume flow)
-_resume_sessions: dict[str, WalmartResumeSession] = {}
+SESSION_TTL = 600.0       # seconds an idle /link or /resume browser is kept open
+MAX_SESSIONS = 32         # per registry
 
-# Track which job_id is awaiting phone-solve for each chat, so the uploaded
-# cookie file knows which job to retry.
-_phone_solve_jobs: dict[int, str] = {}   # chat_id → job_id
 
-# ── Inline keyboard helpers ────────────────────────────────────────────────────
+class _SessionRegistry:
+    """
+    key → live browser session (WalmartLinker / WalmartResumeSession), bounded
+    in size and idle time.
+
+    Each session pins a live browser, so a /link or /resume that is never
+    finished must not stay open forever: the least recently used entry is
+    closed once more than *max_size* are open, and a janitor task closes any
+    left idle for *ttl* seconds. The janitor only runs while the registry is
+    non-empty.
+    """
 
-def _get_phone_solve_base() -> str:
-    """Return base URL for the phone-solve page (env override or local IP)."""
-    override = os.getenv("PHONE_SOLVE_URL", "").strip().rstrip("/")
-    if override:
-        return override
+    def __init__(self, name: str, max_size: int = MAX_SESSIONS, ttl: float = SESSION_TTL) -> None:
+        self._name = name
+        self._entries: OrderedDict = OrderedDict()   # key → (session, last_used)
+        self._max_size = max_size
+        self._ttl = ttl
+        self._janitor: asyncio.Task | None = None
+        self._closing: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries[key] = (entry[0], time.monotonic())
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, session) -> None:
+        self._entries[key] = (session, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            evicted_key, (evicted, _) = self._entries.popitem(last=False)
+            logger.info("Evicting browser session",
+                        extra={"registry": self._name, "key": evicted_key})
+            self._close_later(evicted)
+        if self._janitor is None or self._janitor.done():
+            self._janitor = asyncio.create_task(self._sweep())
+
+    def pop(self, key, session=None):
+        """Remove and return *key*'s session; with *session*, only if it is still that one."""
+        entry = self._entries.get(key)
+        if entry is None or (session is not None and entry[0] is not session):
+            return None
+        del self._entries[key]
+        return entry[0]
+
+    def _close_later(self, session) -> None:
+        task = asyncio.create_task(_close_quietly(session))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _sweep(self) -> None:
+        while self._entries:
+            await asyncio.sleep(60)
+            cutoff = time.monotonic() - self._ttl
+            for key, (session, _) in list(self._entries.items()):
+                # Re-check against the live entry: closes below yield, and the
+                # key may since have been popped, replaced or used again
+                entry = self._entries.get(key)
+                if entry is None or entry[0] is not session or entry[1] >= cutoff:
+                    continue
+                del self._entries[key]
+                logger.info("Closing idle browser session",
+                            extra={"registry": self._name, "key": key})
+                await _close_quietly(session)
+            logger.info("Browser sessions open",
+                        extra={"registry": self._name, "count": len(self._entries)})
+
+
+async def _close_quietly(session) -> None:
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return f"http://{ip}:8000"
+        await session.close()
     except Exception:
-        return "http://localhost:8000"
+        pass
+
+
+def _key(ident: int | str) -> tuple[str, int | str]:
+    """Scope a chat_id / job_id to this bot: (BOT_ID, ident)."""
+    return (BOT_ID, ident)
 
 
+# _key(chat_id) → active WalmartLinker (for /link flow)
+_link_sessions = _SessionRegistry("link")
+
+# _key(job_id) → active WalmartResumeSession (for /resume flow)
+_resume_sessions = _SessionRegistry("resume")
+
+# Track which job_id is awaiting phone-solve for each chat, so the uploaded
+# cookie file knows which job to retry.
+_phone_solve_jobs: dict[tuple[str, int], str] = {}   # _key(chat_id) → job_id
+
+# Latest cart build per chat, from any flow that starts one, so a /run while
+# it's still building points at that job instead of launching a second
+# browser. Builds started more than _RUN_GUARD_TTL ago no longer block.
+_chat_run_jobs: OrderedDict = OrderedDict()   # _key(chat_id) → (job_id, started_at)
+_CHAT_RUN_JOBS_MAX = 1024
+_RUN_GUARD_TTL = 30 * 60.0
+
+
+def _track_build(chat_id: int, job_id: str) -> None:
+    key = _key(chat_id)
+    _chat_run_jobs[key] = (job_id, time.monotonic())
+    _chat_run_jobs.move_to_end(key)
+    if len(_chat_run_jobs) > _CHAT_RUN_JOBS_MAX:
+        _chat_run_jobs.popitem(last=False)
+
+
+# Telegram file_id of each screenshot already uploaded, so a repeat
+# /screenshot resends by reference instead of re-uploading the JPEG. Dropped
+# when the job finishes again, since a new run overwrites the file.
+_screenshot_file_ids: OrderedDict = OrderedDict()   # _key(job_id) → file_id
+_SCREENSHOT_FILE_IDS_MAX = 1024
+
+# Per-chat gate for handlers that (re)start a cart build, so a double-tapped
+# Retry or a /run racing a /continue can't reset and schedule the same chat's
+# jobs concurrently. Entries are dropped once nobody holds or awaits them.
+_job_gates: dict[tuple[str, int], asyncio.Semaphore] = {}
+_job_gate_users: dict[tuple[str, int], int] = {}
+
+
+@asynccontextmanager
+async def _job_gate(chat_id: int):
+    key = _key(chat_id)
+    gate = _job_gates.get(key)
+    if gate is None:
+        gate = _job_gates[key] = asyncio.Semaphore(1)
+    _job_gate_users[key] = _job_gate_users.get(key, 0) + 1
+    try:
+        async with gate:
+            yield
+    finally:
+        _job_gate_users[key] -= 1
+        if not _job_gate_users[key]:
+            del _job_gate_users[key]
+            del _job_gates[key]
+
+# ── Inline keyboard helpers ────────────────────────────────────────────────────
+
+@functools.lru_cache(maxsize=2048)
 def _challenge_keyboard(job_id: str) -> InlineKeyboardMarkup:
     """
     Keyboard shown when Walmart triggers a bot challenge.
@@ -90,8 +234,11 @@ def _challenge_keyboard(job_id: str) -> InlineKeyboardMarkup:
       2. Follow steps: visit Walmart, run JS snippet, download cookie file, send to bot
          — OR —
       3. Tap 'Retry' to just try again (after waiting a few minutes)
+
+    PTB markups are immutable, so one instance per job is built and reused for
+    every repeat challenge; the LRU bound keeps old jobs from piling up.
     """
-    solve_url = f"{_get_phone_solve_base()}/phone-solve/{job_id}"
+    solve_url = f"{get_phone_solve_base()}/phone-solve/{job_id}"
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("📱 Solve from Phone", url=solve_url)],
         [InlineKeyboardButton("🔄 Retry Cart Build", callback_data=f"retry:{job_id}")],
@@ -131,11 +278,113 @@ _HELP = """
 /help - show this message
 """.strip()
 
+# Cart URLs and the like are for tapping, not previewing — and Telegram fetches
+# a preview server-side before delivering the message
+_NO_PREVIEW = LinkPreviewOptions(is_disabled=True)
+
+# Complete reply_text arguments, built once for every /help and /start
+_HELP_KWARGS = {
+    "text": _HELP,
+    "parse_mode": ParseMode.MARKDOWN,
+    "link_preview_options": _NO_PREVIEW,
+}
+
+
+# ── Message templates ──────────────────────────────────────────────────────────
+# Job ids are hex (see models.job), so they need no Markdown escaping. Free
+# text (item names, brands, error strings) goes through escape_markdown before
+# it is interpolated, so a stray "_" or "*" can't break the message.
+
+_MD = {"parse_mode": ParseMode.MARKDOWN, "link_preview_options": _NO_PREVIEW}
+
+_STATUS_TMPL = "Job `{job_id}`\nStatus: *{status}*"
+_STATUS_DONE_TMPL = "\n\nCart URL:\n{url}"
+_STATUS_ERR_TMPL = "\nError: {error}"
+_STATUS_NEEDS_USER = (
+    "\n\nWalmart showed a bot/CAPTCHA challenge. "
+    "Use /link to re-authenticate, then /run again."
+)
+
+_RUN_IN_FLIGHT_TMPL = (
+    "Already building your cart 🛒\nJob ID: `{job_id}`\n"
+    "I'll send you the link when it's ready."
+)
+_RUN_QUEUED_TMPL = (
+    "Building your Walmart.ca cart... 🛒\nJob ID: `{job_id}`\n"
+    "I'll send you the link when it's ready."
+)
+_CART_READY_TMPL = (
+    "Cart ready! 🎉\n{summary}\n\n"
+    "🛒 {url}\n\n"
+    "_Make sure you're logged into your Walmart account in your browser before opening the link._\n\n"
+    "Job: `{job_id}`"
+)
+_CART_BLOCKED = (
+    "Walmart is blocking the bot 🤖\n\n"
+    "Tap *Solve from Phone* for step-by-step instructions to fix it from your phone.\n\n"
+    "Or tap *Retry* to try again in a few minutes."
+)
+_CART_STILL_BLOCKED = (
+    "Walmart is still blocking the bot 🤖\n\n"
+    "Tap *Solve from Phone* for step-by-step instructions to fix it from your phone.\n\n"
+    "Or wait a few minutes and tap *Retry*."
+)
+_CART_BLOCKED_AGAIN = (
+    "Walmart blocked the bot again 🤖\n\n"
+    "Tap *Solve from Phone* for step-by-step instructions to fix it from your phone.\n\n"
+    "Or tap *Retry* to try again in a few minutes."
+)
+_CART_COOKIES_NOT_ENOUGH = (
+    "Still blocked 🤖 The cookies helped but weren't enough.\n\n"
+    "Wait a few minutes and tap *Retry*, or try the phone-solve steps again."
+)
+_CART_FAILED_TMPL = "Cart build failed ❌\nJob: `{job_id}`\nError: {error}{fail_note}"
+
+# Text sent with the challenge keyboard, by the flow that started the build
+_CART_BLOCKED_BY_FLAVOR = {
+    "run":     _CART_BLOCKED,
+    "ai":      _CART_BLOCKED,
+    "resume":  _CART_STILL_BLOCKED,
+    "retry":   _CART_BLOCKED_AGAIN,
+    "cookies": _CART_COOKIES_NOT_ENOUGH,
+}
+
+
+_ITEM_FMT = "• {}x {}".format
+
+
+def _item_line(item: dict) -> str:
+    """
+    One list bullet: "• 2x milk", plus an italic brand / price-cap note if set.
+
+    Takes parsed items ("name") and stored rows ("text") alike.
+    """
+    line = _ITEM_FMT(item["qty"], escape_markdown(item.get("name") or item["text"]))
+    brand, max_price = item.get("brand"), item.get("max_price")
+    if not brand and max_price is None:
+        return line
+    extras = []
+    if brand:
+        extras.append(f"brand: {escape_markdown(brand)}")
+    if max_price is not None:
+        extras.append(f"max ${max_price:.2f}")
+    return f"{line}  _({', '.join(extras)})_"
+
+
+async def _send_tmpl(bot, chat_id: int, tmpl: str, reply_markup=None, **fields) -> None:
+    """Send a Markdown template, formatted with *fields*."""
+    await bot.send_message(
+        chat_id=chat_id,
+        text=tmpl.format_map(fields) if fields else tmpl,
+        reply_markup=reply_markup,
+        **_MD,
+    )
+
 
 # ── /help & /start ─────────────────────────────────────────────────────────────
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(_HELP, parse_mode="Markdown")
+    await update.message.reply_text(**_HELP_KWARGS)
 
 
 # ── /set ───────────────────────────────────────────────────────────────────────
@@ -158,7 +407,13 @@ async def set_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     else:
         postal_parts = args
 
-    postal_code = " ".join(postal_parts).upper()
+    postal_code = normalize_postal_code(" ".join(postal_parts))
+    if postal_code is None:
+        await update.message.reply_text(
+            "That's not a valid Canadian postal code.\n"
+            "Example: /set M5V3A1 delivery"
+        )
+        return
 
     existing = await get_chat(chat_id)
     store = existing["store"] if existing else ""
@@ -172,12 +427,17 @@ async def set_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
 # ── /add ───────────────────────────────────────────────────────────────────────
 
+_INLINE_PARSE_MAX = 512   # chars; longer /add payloads are parsed in a thread
+
+
 async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
-    text = update.message.text or ""
-    parts = text.split(None, 1)
+    message = update.message
+    # CommandHandler only fires on messages that open with a bot_command
+    # entity; its length covers "/add" as well as "/add@BotName"
+    body = message.text[message.entities[0].length:].strip()
 
-    if len(parts) < 2:
+    if not body:
         await update.message.reply_text(
             "Usage: /add <items>\n"
             "Examples:\n"
@@ -188,33 +448,23 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         )
         return
 
-    items = parse_items(parts[1])
+    # Pasted lists can be long — keep their regex work off the event loop, but
+    # short ones parse faster inline than a thread hop costs
+    items = (
+        await asyncio.to_thread(parse_items, body)
+        if len(body) > _INLINE_PARSE_MAX
+        else parse_items(body)
+    )
     if not items:
         await update.message.reply_text(
             "Couldn't parse any items. Try: /add milk, 2x eggs, bread"
         )
         return
 
-    # Ensure chat row exists
-    if not await get_chat(chat_id):
-        await upsert_chat(chat_id)
-
     await add_items(chat_id, items)
 
-    lines = []
-    for item in items:
-        line = f"• {item['qty']}x {item['name']}"
-        extras = []
-        if item.get("brand"):
-            extras.append(f"brand: {item['brand']}")
-        if item.get("max_price") is not None:
-            extras.append(f"max ${item['max_price']:.2f}")
-        if extras:
-            line += f"  _({', '.join(extras)})_"
-        lines.append(line)
-
     await update.message.reply_text(
-        "Added:\n" + "\n".join(lines),
+        "Added:\n" + "\n".join(map(_item_line, items)),
         parse_mode="Markdown",
     )
 
@@ -223,30 +473,18 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
 async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
-    rows = await get_items(chat_id)
+    chat, rows = await get_chat_and_items(chat_id)
 
     if not rows:
         await update.message.reply_text("Your list is empty. Use /add to add items.")
         return
 
-    lines = []
-    for r in rows:
-        line = f"• {r['qty']}x {r['text']}"
-        extras = []
-        if r.get("brand"):
-            extras.append(f"brand: {r['brand']}")
-        if r.get("max_price") is not None:
-            extras.append(f"max ${r['max_price']:.2f}")
-        if extras:
-            line += f"  _({', '.join(extras)})_"
-        lines.append(line)
-
-    chat = await get_chat(chat_id)
     postal = chat["postal_code"] if chat else "not set"
     mode = chat["mode"] if chat else "delivery"
 
     await update.message.reply_text(
-        f"*Shopping List*\n" + "\n".join(lines) + f"\n\nPostal: `{postal}` | Mode: `{mode}`",
+        "*Shopping List*\n" + "\n".join(map(_item_line, rows))
+        + f"\n\nPostal: `{postal}` | Mode: `{mode}`",
         parse_mode="Markdown",
     )
 
@@ -261,132 +499,179 @@ async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 # ── /status ────────────────────────────────────────────────────────────────────
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    args = context.args
-    if not args:
-        await update.message.reply_text("Usage: /status <job_id>")
+    job_id = await _job_id_arg(update, context, "/status")
+    if job_id is None:
         return
 
-    job = await get_job(args[0])
+    job = await _get_own_job(job_id, update.effective_chat.id)
     if not job:
-        await update.message.reply_text(f"Job `{args[0]}` not found.", parse_mode="Markdown")
+        await update.message.reply_text(f"Job `{job_id}` not found.", parse_mode="Markdown")
         return
 
     status = job["status"]
-    msg = f"Job `{job['job_id']}`\nStatus: *{status}*"
+    msg = _STATUS_TMPL.format(job_id=job["job_id"], status=status)
 
     if status == "done" and job["result_url"]:
-        msg += f"\n\nCart URL:\n{job['result_url']}"
+        msg += _STATUS_DONE_TMPL.format(url=job["result_url"])
     elif status in ("failed", "needs_user") and job["error"]:
-        msg += f"\nError: {job['error']}"
+        msg += _STATUS_ERR_TMPL.format(error=escape_markdown(job["error"]))
         if status == "needs_user":
-            msg += (
-                "\n\nWalmart showed a bot/CAPTCHA challenge. "
-                "Use /link to re-authenticate, then /run again."
-            )
+            msg += _STATUS_NEEDS_USER
 
-    await update.message.reply_text(msg, parse_mode="Markdown")
+    await update.message.reply_text(msg, **_MD)
 
 
 # ── /run ───────────────────────────────────────────────────────────────────────
 
 async def run_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
+    async with _job_gate(chat_id):
+        await _run(update, context, chat_id)
+
+
+async def _in_flight_build(chat_id: int) -> str | None:
+    """Job id of the chat's tracked build while it is still pending or running."""
+    key = _key(chat_id)
+    tracked = _chat_run_jobs.get(key)
+    if not tracked:
+        return None
+    prev_id, started_at = tracked
+    if time.monotonic() - started_at < _RUN_GUARD_TTL:
+        prev = await get_job(prev_id)
+        if prev and prev["status"] in ("pending", "running"):
+            return prev_id
+    del _chat_run_jobs[key]
+    return None
+
+
+async def _run(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
+    prev_id = await _in_flight_build(chat_id)
+    if prev_id:
+        await update.message.reply_text(_RUN_IN_FLIGHT_TMPL.format(job_id=prev_id), **_MD)
+        return
+
     rows = await get_items(chat_id)
 
     if not rows:
         await update.message.reply_text("Your list is empty. Use /add first.")
         return
 
-    job_id = str(uuid.uuid4())[:8]
-    await create_job(job_id, chat_id)
+    job = await create_job(chat_id)
+    job_id = job["job_id"]
+    _track_build(chat_id, job_id)
 
-    await update.message.reply_text(
-        f"Building your Walmart.ca cart... 🛒\nJob ID: `{job_id}`\n"
-        "I'll send you the link when it's ready.",
-        parse_mode="Markdown",
+    await update.message.reply_text(_RUN_QUEUED_TMPL.format(job_id=job_id), **_MD)
+
+    register_callback(job_id, CartDoneCallback(context.bot, job_id, "run"))
+    schedule_job(job)
+
+
+def _build_cart_summary(added: list[str], failed: list[str]) -> str:
+    """One-line (or partial-success) summary of what made it into the cart."""
+    total = len(added) + len(failed)
+    if not failed:
+        return f"✅ All {total} item(s) added"
+    return (
+        f"⚠️ {len(added)}/{total} items added\n"
+        + (("✅ " + ", ".join(map(escape_markdown, added)) + "\n") if added else "")
+        + "❌ Failed: " + ", ".join(map(escape_markdown, failed))
     )
 
-    async def on_done(
+
+@dataclass(slots=True)
+class CartDoneCallback:
+    """
+    Job-worker callback shared by every flow that starts a cart build.
+
+    Holds only the bot and job id — not the handler's update/context — so an
+    in-flight job doesn't keep the originating handler alive. *flavor* names
+    the starting flow and picks the needs_user text (_CART_BLOCKED_BY_FLAVOR).
+    """
+
+    bot: Bot
+    job_id: str
+    flavor: str   # "run" | "ai" | "resume" | "retry" | "cookies"
+
+    async def __call__(
+        self,
         cid: int,
         url: str | None,
         status: str,
         error: str | None = None,
         result: dict | None = None,
     ) -> None:
+        _screenshot_file_ids.pop(_key(self.job_id), None)
         res = result or {}
         added: list[str] = res.get("added", [])
         failed: list[str] = res.get("failed", [])
-        total = len(added) + len(failed)
 
         if status == "done" and url:
-            if failed:
-                summary = (
-                    f"⚠️ {len(added)}/{total} items added\n"
-                    + (("✅ " + ", ".join(added) + "\n") if added else "")
-                    + "❌ Failed: " + ", ".join(failed)
-                )
-            else:
-                summary = f"✅ All {total} item(s) added"
-
-            await context.bot.send_message(
-                chat_id=cid,
-                text=(
-                    f"Cart ready! 🎉\n{summary}\n\n"
-                    f"🛒 {url}\n\n"
-                    "_Make sure you're logged into your Walmart account in your browser before opening the link._\n\n"
-                    f"Job: `{job_id}`"
-                ),
-                parse_mode="Markdown",
+            await _send_tmpl(
+                self.bot, cid, _CART_READY_TMPL,
+                summary=_build_cart_summary(added, failed), url=url, job_id=self.job_id,
             )
         elif status == "needs_user":
-            _phone_solve_jobs[cid] = job_id
-            await context.bot.send_message(
-                chat_id=cid,
-                text=(
-                    "Walmart is blocking the bot 🤖\n\n"
-                    "Tap *Solve from Phone* for step-by-step instructions to fix it from your phone.\n\n"
-                    "Or tap *Retry* to try again in a few minutes."
-                ),
-                parse_mode="Markdown",
-                reply_markup=_challenge_keyboard(job_id),
+            _phone_solve_jobs[_key(cid)] = self.job_id
+            await _send_tmpl(
+                self.bot, cid, _CART_BLOCKED_BY_FLAVOR[self.flavor],
+                reply_markup=_challenge_keyboard(self.job_id),
             )
         else:
-            fail_note = ""
-            if failed:
-                fail_note = "\nFailed items: " + ", ".join(failed)
-            await context.bot.send_message(
-                chat_id=cid,
-                text=f"Cart build failed ❌\nJob: `{job_id}`\nError: {error or 'Unknown'}{fail_note}",
-                parse_mode="Markdown",
+            fail_note = (
+                "\nFailed items: " + ", ".join(map(escape_markdown, failed))
+            ) if failed else ""
+            await _send_tmpl(
+                self.bot, cid, _CART_FAILED_TMPL,
+                job_id=self.job_id, error=escape_markdown(error or "Unknown"),
+                fail_note=fail_note,
             )
 
-    register_callback(job_id, on_done)
-    job = await get_job(job_id)
-    schedule_job(job)
-
 
 # ── /screenshot ────────────────────────────────────────────────────────────────
 
 async def screenshot_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    args = context.args
-    if not args:
-        await update.message.reply_text("Usage: /screenshot <job_id>")
+    job_id = await _job_id_arg(update, context, "/screenshot")
+    if job_id is None:
         return
 
-    job_id = args[0]
-    path = Path(f"storage/screenshots/{job_id}.png")
+    if not await _get_own_job(job_id, update.effective_chat.id):
+        await update.message.reply_text(
+            f"No screenshot found for job `{job_id}`.", parse_mode="Markdown"
+        )
+        return
+
+    caption = f"Screenshot for job `{job_id}`"
+    file_id = _screenshot_file_ids.get(_key(job_id))
+    if file_id:
+        await update.message.reply_photo(photo=file_id, caption=caption, parse_mode="Markdown")
+        return
 
-    if not path.exists():
+    try:
+        path, data = await asyncio.to_thread(_read_screenshot, job_id)
+    except FileNotFoundError:
         await update.message.reply_text(
             f"No screenshot found for job `{job_id}`.", parse_mode="Markdown"
         )
         return
 
-    await update.message.reply_photo(
-        photo=open(path, "rb"),
-        caption=f"Screenshot for job `{job_id}`",
+    sent = await update.message.reply_photo(
+        photo=InputFile(data, filename=path.name),
+        caption=caption,
         parse_mode="Markdown",
     )
+    _screenshot_file_ids[_key(job_id)] = sent.photo[-1].file_id
+    if len(_screenshot_file_ids) > _SCREENSHOT_FILE_IDS_MAX:
+        _screenshot_file_ids.popitem(last=False)
+
+
+def _read_screenshot(job_id: str) -> tuple[Path, bytes]:
+    """Load a job's screenshot; older builds saved PNGs, so fall back to those."""
+    path = SCREENSHOT_DIR / f"{job_id}.jpg"
+    try:
+        return path, path.read_bytes()
+    except FileNotFoundError:
+        path = path.with_suffix(".png")
+        return path, path.read_bytes()
 
 
 # ── /resume ────────────────────────────────────────────────────────────────────
@@ -396,13 +681,11 @@ async def resume_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     /resume <job_id>  — open a headful browser so the user can solve the
     bot challenge, then send /continue <job_id> when done.
     """
-    args = context.args
-    if not args:
-        await update.message.reply_text("Usage: /resume <job_id>")
+    job_id = await _job_id_arg(update, context, "/resume")
+    if job_id is None:
         return
 
-    job_id = args[0]
-    job = await get_job(job_id)
+    job = await _get_own_job(job_id, update.effective_chat.id)
     if not job:
         await update.message.reply_text(
             f"Job `{job_id}` not found.", parse_mode="Markdown"
@@ -429,11 +712,13 @@ async def resume_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
 
     session = WalmartResumeSession(postal_code=postal_code)
-    _resume_sessions[job_id] = session
+    _resume_sessions.put(_key(job_id), session)
     try:
         await session.start()
     except Exception as exc:
-        _resume_sessions.pop(job_id, None)
+        # A /resume sent meanwhile may have replaced this entry; leave that one
+        _resume_sessions.pop(_key(job_id), session)
+        await _close_quietly(session)
         logger.error("Failed to open resume browser", extra={"job_id": job_id, "error": str(exc)})
         await update.message.reply_text(f"Failed to open browser: {exc}")
 
@@ -446,13 +731,23 @@ async def continue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     in the headful browser opened by /resume.  Saves the fresh session,
     closes the browser, resets the job, and re-runs the cart build.
     """
-    args = context.args
-    if not args:
-        await update.message.reply_text("Usage: /continue <job_id>")
+    async with _job_gate(update.effective_chat.id):
+        await _continue(update, context)
+
+
+async def _continue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    job_id = await _job_id_arg(update, context, "/continue")
+    if job_id is None:
         return
 
-    job_id = args[0]
-    session = _resume_sessions.pop(job_id, None)
+    job = await _get_own_job(job_id, update.effective_chat.id)
+    if not job:
+        await update.message.reply_text(
+            f"Job `{job_id}` not found.", parse_mode="Markdown"
+        )
+        return
+
+    session = _resume_sessions.pop(_key(job_id))
     if session is None:
         await update.message.reply_text(
             f"No active resume session for `{job_id}`.\n"
@@ -467,14 +762,6 @@ async def continue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     except Exception as exc:
         logger.warning("Error closing resume session", extra={"job_id": job_id, "error": str(exc)})
 
-    job = await get_job(job_id)
-    if not job:
-        await update.message.reply_text(
-            f"Job `{job_id}` not found.", parse_mode="Markdown"
-        )
-        return
-
-    chat_id = job["chat_id"]
     await update.message.reply_text(
         f"Verification saved! Resuming cart build for job `{job_id}`... 🛒",
         parse_mode="Markdown",
@@ -483,53 +770,8 @@ async def continue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     # Reset job to pending so process_job() will run it again
     await update_job(job_id, "pending", error=None, screenshot=None)
 
-    async def on_done(
-        cid: int,
-        url: str | None,
-        status: str,
-        error: str | None = None,
-        result: dict | None = None,
-    ) -> None:
-        res = result or {}
-        added: list[str] = res.get("added", [])
-        failed: list[str] = res.get("failed", [])
-        total = len(added) + len(failed)
-
-        if status == "done" and url:
-            if failed:
-                summary = (
-                    f"⚠️ {len(added)}/{total} items added\n"
-                    + (("✅ " + ", ".join(added) + "\n") if added else "")
-                    + "❌ Failed: " + ", ".join(failed)
-                )
-            else:
-                summary = f"✅ All {total} item(s) added"
-            await context.bot.send_message(
-                chat_id=cid,
-                text=f"Cart ready! 🎉\n{summary}\n\n🛒 {url}\n\nJob: `{job_id}`",
-                parse_mode="Markdown",
-            )
-        elif status == "needs_user":
-            _phone_solve_jobs[cid] = job_id
-            await context.bot.send_message(
-                chat_id=cid,
-                text=(
-                    "Walmart is still blocking the bot 🤖\n\n"
-                    "Tap *Solve from Phone* for step-by-step instructions to fix it from your phone.\n\n"
-                    "Or wait a few minutes and tap *Retry*."
-                ),
-                parse_mode="Markdown",
-                reply_markup=_challenge_keyboard(job_id),
-            )
-        else:
-            fail_note = ("\nFailed items: " + ", ".join(failed)) if failed else ""
-            await context.bot.send_message(
-                chat_id=cid,
-                text=f"Cart build failed ❌\nJob: `{job_id}`\nError: {error or 'Unknown'}{fail_note}",
-                parse_mode="Markdown",
-            )
-
-    register_callback(job_id, on_done)
+    _track_build(job["chat_id"], job_id)
+    register_callback(job_id, CartDoneCallback(context.bot, job_id, "resume"))
     schedule_job(job)
 
 
@@ -546,7 +788,7 @@ async def link_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     session_file = Path(SESSION_PATH)
 
-    if session_file.exists() and not confirming:
+    if not confirming and await asyncio.to_thread(session_file.exists):
         await update.message.reply_text(
             "A Walmart session already exists.\n"
             "Send `/link confirm` to overwrite it.",
@@ -562,12 +804,12 @@ async def link_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
 
     linker = WalmartLinker()
-    _link_sessions[chat_id] = linker
+    _link_sessions.put(_key(chat_id), linker)
 
     try:
         await linker.start()
     except Exception as exc:
-        _link_sessions.pop(chat_id, None)
+        _link_sessions.pop(_key(chat_id))
         logger.error("Failed to open browser for /link: %s", exc, exc_info=True)
         await update.message.reply_text(f"Failed to open browser: {exc}")
 
@@ -578,7 +820,7 @@ async def link_done_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     Checks login state, saves session, and closes the browser.
     """
     chat_id = update.effective_chat.id
-    linker = _link_sessions.get(chat_id)
+    linker = _link_sessions.get(_key(chat_id))
 
     if linker is None:
         await update.message.reply_text(
@@ -599,7 +841,7 @@ async def link_done_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         await linker.save_session(SESSION_PATH)
         await linker.close()
-        _link_sessions.pop(chat_id, None)
+        _link_sessions.pop(_key(chat_id))
 
         await update.message.reply_text(
             "Walmart linked ✅\n"
@@ -614,71 +856,36 @@ async def link_done_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 # ── AI conversational handler (catches all non-command messages) ───────────────
 
+async def _ai_send(bot, chat_id: int, msg: str) -> None:
+    await bot.send_message(chat_id=chat_id, text=msg, link_preview_options=_NO_PREVIEW)
+
+
+async def _ai_trigger_job(bot, chat_id: int) -> tuple[str, bool]:
+    """Start a build for the AI build_cart tool, under the same guard as /run."""
+    async with _job_gate(chat_id):
+        prev_id = await _in_flight_build(chat_id)
+        if prev_id:
+            return prev_id, False
+        job = await create_job(chat_id)
+        job_id = job["job_id"]
+        _track_build(chat_id, job_id)
+        register_callback(job_id, CartDoneCallback(bot, job_id, "ai"))
+        schedule_job(job)
+        return job_id, True
+
+
 async def ai_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.effective_chat.id
-    text    = (update.message.text or "").strip()
+    text = (update.message.text or "").strip()
     if not text:
         return
 
-    async def send(msg: str) -> None:
-        await context.bot.send_message(chat_id=chat_id, text=msg)
-
-    async def trigger_job(job_id: str) -> None:
-        async def on_done(
-            cid: int,
-            url: str | None,
-            status: str,
-            error: str | None = None,
-            result: dict | None = None,
-        ) -> None:
-            res    = result or {}
-            added  = res.get("added",  [])
-            failed = res.get("failed", [])
-            total  = len(added) + len(failed)
-
-            if status == "done" and url:
-                summary = (
-                    (
-                        f"⚠️ {len(added)}/{total} items added\n"
-                        + (("✅ " + ", ".join(added) + "\n") if added else "")
-                        + "❌ Failed: " + ", ".join(failed)
-                    ) if failed else f"✅ All {total} item(s) added"
-                )
-                await context.bot.send_message(
-                    chat_id=cid,
-                    text=(
-                        f"Cart ready! 🎉\n{summary}\n\n"
-                        f"🛒 {url}\n\n"
-                        "_Make sure you're logged into Walmart in your browser before opening._\n\n"
-                        f"Job: `{job_id}`"
-                    ),
-                    parse_mode="Markdown",
-                )
-            elif status == "needs_user":
-                _phone_solve_jobs[cid] = job_id
-                await context.bot.send_message(
-                    chat_id=cid,
-                    text=(
-                        "Walmart is blocking the bot 🤖\n\n"
-                        "Tap *Solve from Phone* for step-by-step instructions to fix it from your phone.\n\n"
-                        "Or tap *Retry* to try again in a few minutes."
-                    ),
-                    parse_mode="Markdown",
-                    reply_markup=_challenge_keyboard(job_id),
-                )
-            else:
-                fail_note = ("\nFailed: " + ", ".join(failed)) if failed else ""
-                await context.bot.send_message(
-                    chat_id=cid,
-                    text=f"Cart build failed ❌\nError: {error or 'Unknown'}{fail_note}\nJob: `{job_id}`",
-                    parse_mode="Markdown",
-                )
-
-        register_callback(job_id, on_done)
-        job = await get_job(job_id)
-        schedule_job(job)
-
-    await ai_handle(chat_id, text, send, trigger_job)
+    chat_id = update.effective_chat.id
+    bot = context.bot
+    await ai_handle(
+        chat_id, text,
+        functools.partial(_ai_send, bot, chat_id),
+        functools.partial(_ai_trigger_job, bot, chat_id),
+    )
 
 
 # ── Inline button handler ──────────────────────────────────────────────────────
@@ -698,74 +905,31 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     action, job_id = data.split(":", 1)
+    if not is_job_id(job_id):
+        return
     chat_id = update.effective_chat.id
 
     # ── "Retry" tapped ─────────────────────────────────────────────────────────
     if action == "retry":
-        job = await get_job(job_id)
-        if not job:
-            await query.edit_message_text(f"Job `{job_id}` not found.", parse_mode="Markdown")
-            return
+        async with _job_gate(chat_id):
+            await _retry(query, context, job_id, chat_id)
 
-        await query.edit_message_text("Retrying cart build... 🛒")
-        await update_job(job_id, "pending", error=None, screenshot=None)
-
-        async def on_done(
-            cid: int,
-            url: str | None,
-            status: str,
-            error: str | None = None,
-            result: dict | None = None,
-        ) -> None:
-            res    = result or {}
-            added  = res.get("added",  [])
-            failed = res.get("failed", [])
-            total  = len(added) + len(failed)
-
-            if status == "done" and url:
-                summary = (
-                    (
-                        f"⚠️ {len(added)}/{total} items added\n"
-                        + (("✅ " + ", ".join(added) + "\n") if added else "")
-                        + "❌ Failed: " + ", ".join(failed)
-                    ) if failed else f"✅ All {total} item(s) added"
-                )
-                await context.bot.send_message(
-                    chat_id=cid,
-                    text=(
-                        f"Cart ready! 🎉\n{summary}\n\n"
-                        f"🛒 {url}\n\n"
-                        "_Make sure you're logged into Walmart in your browser._\n\n"
-                        f"Job: `{job_id}`"
-                    ),
-                    parse_mode="Markdown",
-                )
-            elif status == "needs_user":
-                _phone_solve_jobs[cid] = job_id
-                await context.bot.send_message(
-                    chat_id=cid,
-                    text=(
-                        "Walmart blocked the bot again 🤖\n\n"
-                        "Tap *Solve from Phone* for step-by-step instructions to fix it from your phone.\n\n"
-                        "Or tap *Retry* to try again in a few minutes."
-                    ),
-                    parse_mode="Markdown",
-                    reply_markup=_challenge_keyboard(job_id),
-                )
-            else:
-                fail_note = ("\nFailed: " + ", ".join(failed)) if failed else ""
-                await context.bot.send_message(
-                    chat_id=cid,
-                    text=(
-                        f"Cart build failed ❌\n"
-                        f"Error: {error or 'Unknown'}{fail_note}\n"
-                        f"Job: `{job_id}`"
-                    ),
-                    parse_mode="Markdown",
-                )
-
-        register_callback(job_id, on_done)
-        schedule_job(job)
+
+async def _retry(query, context: ContextTypes.DEFAULT_TYPE, job_id: str, chat_id: int) -> None:
+    """Reset *job_id* to pending and rebuild the cart (inline Retry button)."""
+    job = await _get_own_job(job_id, chat_id)
+    if not job:
+        await query.edit_message_text(f"Job `{job_id}` not found.", parse_mode="Markdown")
+        return
+    if job["status"] in ("pending", "running"):
+        return  # an earlier tap already restarted it
+
+    await query.edit_message_text("Retrying cart build... 🛒")
+    await update_job(job_id, "pending", error=None, screenshot=None)
+
+    _track_build(chat_id, job_id)
+    register_callback(job_id, CartDoneCallback(context.bot, job_id, "retry"))
+    schedule_job(job)
 
 
 # ── Cookie file upload handler ─────────────────────────────────────────────────
@@ -806,7 +970,7 @@ async def cookie_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     # Find the job that's waiting for phone-solve
-    job_id = _phone_solve_jobs.pop(chat_id, None)
+    job_id = _phone_solve_jobs.pop(_key(chat_id), None)
     if not job_id:
         await update.message.reply_text(
             f"Imported {updated} cookie(s) ✅\n"
@@ -814,6 +978,14 @@ async def cookie_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return
 
+    async with _job_gate(chat_id):
+        await _retry_with_cookies(update, context, chat_id, job_id, updated)
+
+
+async def _retry_with_cookies(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, job_id: str, updated: int,
+) -> None:
+    """Reset *job_id* to pending and rebuild the cart with the imported cookies."""
     job = await get_job(job_id)
     if not job:
         await update.message.reply_text(
@@ -822,59 +994,19 @@ async def cookie_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             parse_mode="Markdown",
         )
         return
+    if job["status"] in ("pending", "running"):
+        # Already restarted (e.g. by a Retry tap); resetting would clobber that run
+        await update.message.reply_text(
+            f"Imported {updated} cookie(s) ✅\n"
+            f"Job `{job_id}` is already building.",
+            parse_mode="Markdown",
+        )
+        return
 
     await update_job(job_id, "pending", error=None, screenshot=None)
 
-    async def on_done(
-        cid: int,
-        url: str | None,
-        status: str,
-        error: str | None = None,
-        result: dict | None = None,
-    ) -> None:
-        res = result or {}
-        added: list[str] = res.get("added", [])
-        failed: list[str] = res.get("failed", [])
-        total = len(added) + len(failed)
-
-        if status == "done" and url:
-            summary = (
-                (
-                    f"⚠️ {len(added)}/{total} items added\n"
-                    + (("✅ " + ", ".join(added) + "\n") if added else "")
-                    + "❌ Failed: " + ", ".join(failed)
-                ) if failed else f"✅ All {total} item(s) added"
-            )
-            await context.bot.send_message(
-                chat_id=cid,
-                text=(
-                    f"Cart ready! 🎉\n{summary}\n\n"
-                    f"🛒 {url}\n\n"
-                    "_Make sure you're logged into Walmart in your browser._\n\n"
-                    f"Job: `{job_id}`"
-                ),
-                parse_mode="Markdown",
-            )
-        elif status == "needs_user":
-            _phone_solve_jobs[cid] = job_id
-            await context.bot.send_message(
-                chat_id=cid,
-                text=(
-                    "Still blocked 🤖 The cookies helped but weren't enough.\n\n"
-                    "Wait a few minutes and tap *Retry*, or try the phone-solve steps again."
-                ),
-                parse_mode="Markdown",
-                reply_markup=_challenge_keyboard(job_id),
-            )
-        else:
-            fail_note = ("\nFailed: " + ", ".join(failed)) if failed else ""
-            await context.bot.send_message(
-                chat_id=cid,
-                text=f"Cart build failed ❌\nError: {error or 'Unknown'}{fail_note}\nJob: `{job_id}`",
-                parse_mode="Markdown",
-            )
-
-    register_callback(job_id, on_done)
+    _track_build(chat_id, job_id)
+    register_callback(job_id, CartDoneCallback(context.bot, job_id, "cookies"))
     schedule_job(job)
 
     await update.message.reply_text(
@@ -886,31 +1018,74 @@ async def cookie_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 # ── Helpers ────────────────────────────────────────────────────────────────────
 
+async def _job_id_arg(update: Update, context: ContextTypes.DEFAULT_TYPE, command: str) -> str | None:
+    """The command's job_id argument, or None once the user has been told the usage."""
+    args = context.args
+    if not args:
+        await update.message.reply_text(f"Usage: {command} <job_id>")
+        return None
+    if not is_job_id(args[0]):
+        # Not echoed back: replies put job ids inside Markdown code spans
+        await update.message.reply_text(f"That's not a job ID.\nUsage: {command} <job_id>")
+        return None
+    return args[0]
+
+
+async def _get_own_job(job_id: str, chat_id: int) -> dict | None:
+    """The job row, or None if it doesn't exist or belongs to another chat."""
+    job = await get_job(job_id)
+    return job if job and job["chat_id"] == chat_id else None
+
+
 async def _close_linker(chat_id: int) -> None:
-    linker = _link_sessions.pop(chat_id, None)
+    linker = _link_sessions.pop(_key(chat_id))
     if linker:
-        try:
-            await linker.close()
-        except Exception:
-            pass
+        await _close_quietly(linker)
 
 
 async def _close_resume_session(job_id: str) -> None:
-    session = _resume_sessions.pop(job_id, None)
+    session = _resume_sessions.pop(_key(job_id))
     if session:
-        try:
-            await session.close()
-        except Exception:
-            pass
+        await _close_quietly(session)
 
 
 # ── App factory ────────────────────────────────────────────────────────────────
 
+class _OrjsonRequest(HTTPXRequest):
+    """HTTPXRequest that decodes Bot API responses with orjson."""
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError as exc:
+            raise TelegramError("Invalid server response") from exc
+
+
 def create_bot_app() -> Application:
     if not TELEGRAM_BOT_TOKEN:
         raise ValueError("TELEGRAM_BOT_TOKEN is not set in environment")
 
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Updates are dispatched as independent tasks; handlers that open a browser
+    # or call Claude are additionally non-blocking so they never hold up others.
+    # Separate pooled HTTP/2 clients for outgoing calls and for getUpdates, so
+    # replies from concurrent handlers don't queue on a single connection. The
+    # getUpdates read timeout leaves headroom over the 30s long-poll timeout.
+    app = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .request(_OrjsonRequest(
+            connection_pool_size=16, http_version="2", connect_timeout=5.0, read_timeout=30.0,
+        ))
+        .get_updates_request(_OrjsonRequest(
+            connection_pool_size=2, http_version="2", connect_timeout=5.0, read_timeout=35.0,
+        ))
+        .concurrent_updates(True)
+        .build()
+    )
+
+    # Jobs resumed after a restart lost their callbacks; still tell the chat
+    set_default_callback(lambda job_id: CartDoneCallback(app.bot, job_id, "run"))
 
     app.add_handler(CommandHandler("start", help_command))
     app.add_handler(CommandHandler("help", help_command))
@@ -918,15 +1093,15 @@ def create_bot_app() -> Application:
     app.add_handler(CommandHandler("add", add_command))
     app.add_handler(CommandHandler("list", list_command))
     app.add_handler(CommandHandler("clear", clear_command))
-    app.add_handler(CommandHandler("run", run_command))
-    app.add_handler(CommandHandler("status", status_command))
+    app.add_handler(CommandHandler("run", run_command, block=False))
+    app.add_handler(CommandHandler("status", status_command, block=False))
     app.add_handler(CommandHandler("screenshot", screenshot_command))
-    app.add_handler(CommandHandler("resume", resume_command))
-    app.add_handler(CommandHandler("continue", continue_command))
-    app.add_handler(CommandHandler("link", link_command))
-    app.add_handler(CommandHandler("link_done", link_done_command))
+    app.add_handler(CommandHandler("resume", resume_command, block=False))
+    app.add_handler(CommandHandler("continue", continue_command, block=False))
+    app.add_handler(CommandHandler("link", link_command, block=False))
+    app.add_handler(CommandHandler("link_done", link_done_command, block=False))
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_handler(MessageHandler(filters.Document.ALL, cookie_file_handler))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, ai_message))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, ai_message, block=False))
 
     return app
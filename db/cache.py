@@ -0,0 +1,78 @@
+"""
+In-process read cache for single-key async DB lookups.
+
+    @async_ttl_cache(ttl=2.0)
+    async def get_job(job_id): ...
+
+    get_job.invalidate(job_id)   # call after any write to that row
+    get_job.prime(job_id, row)   # ...or store the row the write returned
+
+Concurrent misses for the same key share one query (single-flight). Callers
+get copies of cached rows, so mutating a result never touches the cache. A
+read that overlaps an invalidation is returned but not stored. Entries are
+per process; the TTL bounds staleness from writers in other processes.
+"""
+
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return [dict(v) if isinstance(v, dict) else v for v in value]
+    return value
+
+
+def async_ttl_cache(ttl: float, maxsize: int = 10_000):
+    def decorator(fn):
+        entries: OrderedDict = OrderedDict()      # key → (expires_at, value)
+        inflight: dict = {}                       # key → asyncio.Task
+        writes = 0                                # bumped by invalidate()
+
+        def _store(key, gen: int, task: asyncio.Task) -> None:
+            if inflight.get(key) is task:
+                del inflight[key]
+            if task.cancelled() or task.exception() is not None or gen != writes:
+                return
+            entries[key] = (time.monotonic() + ttl, task.result())
+            entries.move_to_end(key)
+            if len(entries) > maxsize:
+                entries.popitem(last=False)
+
+        @functools.wraps(fn)
+        async def wrapper(key):
+            hit = entries.get(key)
+            if hit is not None and hit[0] > time.monotonic():
+                entries.move_to_end(key)
+                return _copy(hit[1])
+
+            task = inflight.get(key)
+            if task is None:
+                task = asyncio.create_task(fn(key))
+                inflight[key] = task
+                task.add_done_callback(functools.partial(_store, key, writes))
+            return _copy(await asyncio.shield(task))
+
+        def invalidate(key) -> None:
+            nonlocal writes
+            writes += 1
+            entries.pop(key, None)
+            inflight.pop(key, None)   # later readers must not join a pre-write query
+
+        def prime(key, value) -> None:
+            """Invalidate *key*, then cache *value* as its fresh result."""
+            invalidate(key)
+            entries[key] = (time.monotonic() + ttl, _copy(value))
+            entries.move_to_end(key)
+            if len(entries) > maxsize:
+                entries.popitem(last=False)
+
+        wrapper.invalidate = invalidate
+        wrapper.prime = prime
+        return wrapper
+
+    return decorator
@@ -1,7 +1,27 @@
+import asyncio
 import os
+import sqlite3
+from contextlib import asynccontextmanager
+from pathlib import Path
+
 import aiosqlite
+import orjson
+
+from db.cache import async_ttl_cache
+from models.job import new_job_id
 
 DB_PATH = os.getenv("DB_PATH", "shopping_agent.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(os.cpu_count() or 4)))
+
+# Read-only connections shared by the read helpers; filled by init_db, drained
+# by close_db. Under WAL they never wait on the writer.
+_pool: asyncio.Queue[aiosqlite.Connection] | None = None
+
+# SQLite allows one writer at a time, so every write goes through this one
+# connection, taken in turn under _write_lock rather than contending for the
+# database lock from several connections
+_writer: aiosqlite.Connection | None = None
+_write_lock = asyncio.Lock()
 
 _CREATE_CHATS = """
 CREATE TABLE IF NOT EXISTS chats (
@@ -9,6 +29,7 @@ CREATE TABLE IF NOT EXISTS chats (
     mode        TEXT    NOT NULL DEFAULT 'delivery',
     postal_code TEXT    NOT NULL DEFAULT '',
     store       TEXT    NOT NULL DEFAULT '',
+    items_version INTEGER NOT NULL DEFAULT 0,
     created_at  DATETIME DEFAULT CURRENT_TIMESTAMP
 )
 """
@@ -40,12 +61,157 @@ CREATE TABLE IF NOT EXISTS jobs (
 )
 """
 
+# Item label (normalized) → Walmart search query produced by the job worker's
+# Haiku rewrite, so repeat staples skip the API call
+_CREATE_QUERY_CACHE = """
+CREATE TABLE IF NOT EXISTS query_cache (
+    raw_label  TEXT PRIMARY KEY,
+    optimized  TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# items by chat in id order (list reads, clears); pending jobs oldest first
+# (the worker's poll) — both index-ordered range scans, no filesort
+_CREATE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_items_chat ON items(chat_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)",
+)
+
+# Conversation history for the AI chat handler, stored as a JSON array of
+# Anthropic message params so any process can pick up the conversation
+_CREATE_HISTORIES = """
+CREATE TABLE IF NOT EXISTS histories (
+    chat_id    INTEGER PRIMARY KEY,
+    messages   TEXT    NOT NULL DEFAULT '[]',
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+# WAL lets readers run while a write commits, and with synchronous=NORMAL a
+# commit no longer waits on an fsync. journal_mode is stored in the database
+# file; the rest are per connection, so _open applies them to every one.
+_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",      # KiB
+    "PRAGMA mmap_size=268435456",    # 256 MiB
+)
+
+# Compiled statements kept per connection (sqlite3 default is 128). The SQL
+# below lives in module constants so each query is always the same cache key.
+_CACHED_STATEMENTS = 256
+
+
+def _dict_row(cursor, row: tuple) -> dict:
+    """row_factory that builds the dict callers get, with no Row in between."""
+    return dict(zip([col[0] for col in cursor.description], row))
+
+
+async def _open(read_only: bool = False) -> aiosqlite.Connection:
+    if read_only:
+        db = await aiosqlite.connect(
+            Path(DB_PATH).resolve().as_uri() + "?mode=ro",
+            uri=True,
+            cached_statements=_CACHED_STATEMENTS,
+        )
+    else:
+        db = await aiosqlite.connect(DB_PATH, cached_statements=_CACHED_STATEMENTS)
+    db.row_factory = _dict_row
+    for pragma in _PRAGMAS:
+        await db.execute(pragma)
+    return db
+
+
+@asynccontextmanager
+async def _connection():
+    """
+    Borrow a pooled read-only connection for the duration of the block.
+
+    Before init_db has run (scripts, one-off tools) a throwaway read-write
+    connection is opened instead. An uncommitted transaction is rolled back before the
+    connection goes back to the pool.
+    """
+    if _pool is None:
+        db = await _open()
+        try:
+            yield db
+        finally:
+            await db.close()
+        return
+
+    db = await _pool.get()
+    try:
+        yield db
+    finally:
+        try:
+            if db.in_transaction:
+                await db.rollback()
+        finally:
+            _pool.put_nowait(db)
+
+
+@asynccontextmanager
+async def _write_connection():
+    """
+    Hold the writer connection for the duration of the block.
+
+    Like _connection(), falls back to a throwaway connection before init_db
+    and rolls back anything left uncommitted.
+    """
+    if _writer is None:
+        async with _connection() as db:
+            yield db
+        return
+
+    async with _write_lock:
+        try:
+            yield _writer
+        finally:
+            if _writer.in_transaction:
+                await _writer.rollback()
+
+
+@asynccontextmanager
+async def _transaction():
+    """
+    Run the block as one BEGIN IMMEDIATE … COMMIT on the writer connection.
+
+    The write lock is taken up front, so statements inside never wait on
+    another writer midway; an exception rolls the whole block back.
+    """
+    async with _write_connection() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            await db.rollback()
+            raise
+        await db.commit()
+
+
+async def close_db() -> None:
+    """Close the writer and every pooled connection."""
+    global _pool, _writer
+    pool, _pool = _pool, None
+    while pool is not None and not pool.empty():
+        await pool.get_nowait().close()
+    writer, _writer = _writer, None
+    if writer is not None:
+        await writer.close()
+
 
 async def init_db() -> None:
+    global _pool, _writer
     async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA wal_autocheckpoint=1000")
         await db.execute(_CREATE_CHATS)
         await db.execute(_CREATE_ITEMS)
         await db.execute(_CREATE_JOBS)
+        await db.execute(_CREATE_HISTORIES)
+        await db.execute(_CREATE_QUERY_CACHE)
 
         # Migrate existing items table — add columns if missing
         for col, typedef in [("max_price", "REAL"), ("brand", "TEXT")]:
@@ -54,25 +220,103 @@ async def init_db() -> None:
             except Exception:
                 pass  # column already exists
 
+        # Migrate existing chats table — items_version bumps on every list change
+        try:
+            await db.execute(
+                "ALTER TABLE chats ADD COLUMN items_version INTEGER NOT NULL DEFAULT 0"
+            )
+        except Exception:
+            pass  # column already exists
+
         # Migrate existing jobs table
         try:
             await db.execute("ALTER TABLE jobs ADD COLUMN screenshot TEXT")
         except Exception:
             pass  # column already exists
 
+        for index in _CREATE_INDEXES:
+            await db.execute(index)
+
         await db.commit()
 
+    if _writer is None:
+        _writer = await _open()
+    if _pool is None:
+        pool: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        for _ in range(DB_POOL_SIZE):
+            pool.put_nowait(await _open(read_only=True))
+        _pool = pool
+
 
 # ── Chat ──────────────────────────────────────────────────────────────────────
 
+_GET_CHAT = "SELECT * FROM chats WHERE chat_id = ?"
+_ENSURE_CHAT = "INSERT INTO chats (chat_id) VALUES (?) ON CONFLICT(chat_id) DO NOTHING"
+_UPSERT_CHAT = """
+INSERT INTO chats (chat_id, mode, postal_code, store)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(chat_id) DO UPDATE SET
+    mode        = excluded.mode,
+    postal_code = excluded.postal_code,
+    store       = excluded.store
+"""
+
+
+@async_ttl_cache(ttl=300.0)
 async def get_chat(chat_id: int) -> dict | None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM chats WHERE chat_id = ?", (chat_id,)
-        ) as cur:
-            row = await cur.fetchone()
-            return dict(row) if row else None
+    async with _connection() as db:
+        rows = await db.execute_fetchall(_GET_CHAT, (chat_id,))
+    return rows[0] if rows else None
+
+
+async def ensure_chat(chat_id: int) -> None:
+    """Create a default chat row if none exists; never touches an existing one."""
+    async with _write_connection() as db:
+        await db.execute(_ENSURE_CHAT, (chat_id,))
+        await db.commit()
+    get_chat.invalidate(chat_id)
+
+
+async def get_chat_and_items(
+    chat_id: int,
+    known_version: int | None = None,
+) -> tuple[dict | None, list[dict]]:
+    """
+    Chat row and its items in one round-trip: (chat | None, items ordered by id).
+
+    If *known_version* equals the chat's items_version the caller already has
+    the current list, so the items are not fetched and [] is returned.
+    """
+    async with _connection() as db:
+        rows = await db.execute_fetchall(
+            """
+            SELECT c.*, i.id AS item_id, i.text, i.qty, i.max_price, i.brand
+            FROM chats c
+            LEFT JOIN items i
+                ON i.chat_id = c.chat_id AND c.items_version IS NOT ?
+            WHERE c.chat_id = ?
+            ORDER BY i.id
+            """,
+            (known_version, chat_id),
+        )
+
+    if not rows:
+        return None, []
+    item_cols = ("item_id", "text", "qty", "max_price", "brand")
+    chat = {k: v for k, v in rows[0].items() if k not in item_cols}
+    items = [
+        {
+            "id":        r["item_id"],
+            "chat_id":   chat_id,
+            "text":      r["text"],
+            "qty":       r["qty"],
+            "max_price": r["max_price"],
+            "brand":     r["brand"],
+        }
+        for r in rows
+        if r["item_id"] is not None
+    ]
+    return chat, items
 
 
 async def upsert_chat(
@@ -81,82 +325,131 @@ async def upsert_chat(
     postal_code: str = "",
     store: str = "",
 ) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            INSERT INTO chats (chat_id, mode, postal_code, store)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(chat_id) DO UPDATE SET
-                mode        = excluded.mode,
-                postal_code = excluded.postal_code,
-                store       = excluded.store
-            """,
-            (chat_id, mode, postal_code, store),
-        )
+    async with _write_connection() as db:
+        await db.execute(_UPSERT_CHAT, (chat_id, mode, postal_code, store))
         await db.commit()
+    get_chat.invalidate(chat_id)
 
 
 # ── Items ─────────────────────────────────────────────────────────────────────
 
+_GET_ITEMS = "SELECT * FROM items WHERE chat_id = ? ORDER BY id"
+_INSERT_ITEM = """
+INSERT INTO items (chat_id, text, qty, max_price, brand)
+VALUES (?, ?, ?, ?, ?)
+"""
+_BUMP_ITEMS_VERSION = (
+    "UPDATE chats SET items_version = items_version + 1 WHERE chat_id = ?"
+)
+
+
+@async_ttl_cache(ttl=2.0)
 async def get_items(chat_id: int) -> list[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM items WHERE chat_id = ? ORDER BY id", (chat_id,)
-        ) as cur:
-            return [dict(r) for r in await cur.fetchall()]
+    async with _connection() as db:
+        return await db.execute_fetchall(_GET_ITEMS, (chat_id,))
 
 
 async def add_items(chat_id: int, items: list[dict]) -> None:
     """
     items: list of dicts with keys: name, qty, max_price (opt), brand (opt)
+
+    Creates a default chat row first if the chat has none, in the same
+    transaction, so callers need no existence check.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _transaction() as db:
+        await db.execute(_ENSURE_CHAT, (chat_id,))
         await db.executemany(
-            """
-            INSERT INTO items (chat_id, text, qty, max_price, brand)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            [
-                (
-                    chat_id,
-                    item["name"],
-                    item["qty"],
-                    item.get("max_price"),
-                    item.get("brand"),
-                )
+            _INSERT_ITEM,
+            (
+                (chat_id, item["name"], item["qty"], item.get("max_price"), item.get("brand"))
                 for item in items
-            ],
+            ),
         )
-        await db.commit()
+        await db.execute(_BUMP_ITEMS_VERSION, (chat_id,))
+    get_items.invalidate(chat_id)
+    get_chat.invalidate(chat_id)
 
 
 async def clear_items(chat_id: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _transaction() as db:
         await db.execute("DELETE FROM items WHERE chat_id = ?", (chat_id,))
-        await db.commit()
+        await db.execute(_BUMP_ITEMS_VERSION, (chat_id,))
+    get_items.invalidate(chat_id)
+    get_chat.invalidate(chat_id)
 
 
-# ── Jobs ──────────────────────────────────────────────────────────────────────
+# ── Chat history ──────────────────────────────────────────────────────────────
 
-async def create_job(job_id: str, chat_id: int) -> dict:
-    async with aiosqlite.connect(DB_PATH) as db:
+async def get_history(chat_id: int, ttl_hours: int = 24) -> list[dict]:
+    """Return the stored message list, or [] if none or older than *ttl_hours*."""
+    async with _connection() as db:
+        rows = await db.execute_fetchall(
+            """
+            SELECT messages FROM histories
+            WHERE chat_id = ? AND updated_at >= datetime('now', ?)
+            """,
+            (chat_id, f"-{ttl_hours} hours"),
+        )
+    return orjson.loads(rows[0]["messages"]) if rows else []
+
+
+async def save_history(chat_id: int, messages: list[dict]) -> None:
+    async with _write_connection() as db:
         await db.execute(
-            "INSERT INTO jobs (job_id, chat_id, status) VALUES (?, ?, 'pending')",
-            (job_id, chat_id),
+            """
+            INSERT INTO histories (chat_id, messages) VALUES (?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                messages   = excluded.messages,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (chat_id, orjson.dumps(messages).decode()),
         )
         await db.commit()
+
+
+# ── Jobs ──────────────────────────────────────────────────────────────────────
+
+_GET_JOB = "SELECT * FROM jobs WHERE job_id = ?"
+_UPDATE_JOB = """
+UPDATE jobs
+SET status = ?, result_url = ?, error = ?, screenshot = ?,
+    updated_at = CURRENT_TIMESTAMP
+WHERE job_id = ?
+RETURNING *
+"""
+_INSERT_JOB = "INSERT INTO jobs (job_id, chat_id, status) VALUES (?, ?, 'pending')"
+_CLAIM_JOB = """
+UPDATE jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP
+WHERE job_id = ? AND status = 'pending'
+"""
+
+
+# Ids are 32 random bits, so a clash is rare but possible; draw again on one
+_CREATE_JOB_ATTEMPTS = 4
+
+
+async def create_job(chat_id: int) -> dict:
+    """Insert a pending job for *chat_id* under a fresh id; returns its row."""
+    async with _write_connection() as db:
+        for attempt in range(_CREATE_JOB_ATTEMPTS):
+            job_id = new_job_id()
+            try:
+                await db.execute(_INSERT_JOB, (job_id, chat_id))
+                break
+            except sqlite3.IntegrityError:
+                if attempt == _CREATE_JOB_ATTEMPTS - 1:
+                    await db.rollback()
+                    raise
+        await db.commit()
+    get_job.invalidate(job_id)
     return {"job_id": job_id, "chat_id": chat_id, "status": "pending"}
 
 
+@async_ttl_cache(ttl=2.0)
 async def get_job(job_id: str) -> dict | None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM jobs WHERE job_id = ?", (job_id,)
-        ) as cur:
-            row = await cur.fetchone()
-            return dict(row) if row else None
+    async with _connection() as db:
+        rows = await db.execute_fetchall(_GET_JOB, (job_id,))
+    return rows[0] if rows else None
 
 
 async def update_job(
@@ -165,24 +458,67 @@ async def update_job(
     result_url: str | None = None,
     error: str | None = None,
     screenshot: str | None = None,
-) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            UPDATE jobs
-            SET status = ?, result_url = ?, error = ?, screenshot = ?,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE job_id = ?
-            """,
-            (status, result_url, error, screenshot, job_id),
+) -> dict | None:
+    """
+    Set a job's state; returns the updated row (None if there is no such job).
+
+    The row also replaces get_job's cached copy, so a /status right after a
+    job finishes needs no read.
+    """
+    async with _write_connection() as db:
+        rows = await db.execute_fetchall(
+            _UPDATE_JOB, (status, result_url, error, screenshot, job_id)
         )
         await db.commit()
+    if rows:
+        get_job.prime(job_id, rows[0])
+        return rows[0]
+    get_job.invalidate(job_id)
+    return None
 
 
-async def get_pending_jobs() -> list[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM jobs WHERE status = 'pending' ORDER BY created_at ASC"
-        ) as cur:
-            return [dict(r) for r in await cur.fetchall()]
+async def claim_job(job_id: str) -> bool:
+    """Atomically move a job from 'pending' to 'running'; False if it wasn't pending."""
+    async with _write_connection() as db:
+        cur = await db.execute(_CLAIM_JOB, (job_id,))
+        await db.commit()
+    get_job.invalidate(job_id)
+    return cur.rowcount == 1
+
+
+async def get_pending_jobs(limit: int = -1) -> list[dict]:
+    """Oldest pending jobs first, at most *limit* of them (-1: all)."""
+    async with _connection() as db:
+        return await db.execute_fetchall(
+            "SELECT * FROM jobs WHERE status = 'pending' ORDER BY created_at ASC LIMIT ?",
+            (limit,),
+        )
+
+
+# ── Search-query cache ────────────────────────────────────────────────────────
+
+async def get_cached_queries(labels: list[str]) -> dict[str, str]:
+    """Cached optimized queries for those of *labels* that have one."""
+    if not labels:
+        return {}
+    async with _connection() as db:
+        rows = await db.execute_fetchall(
+            "SELECT raw_label, optimized FROM query_cache WHERE raw_label IN "
+            f"({', '.join('?' * len(labels))})",
+            labels,
+        )
+    return {r["raw_label"]: r["optimized"] for r in rows}
+
+
+async def save_cached_queries(pairs: dict[str, str]) -> None:
+    async with _write_connection() as db:
+        await db.executemany(
+            """
+            INSERT INTO query_cache (raw_label, optimized) VALUES (?, ?)
+            ON CONFLICT(raw_label) DO UPDATE SET
+                optimized  = excluded.optimized,
+                created_at = CURRENT_TIMESTAMP
+            """,
+            pairs.items(),
+        )
+        await db.commit()
@@ -1,7 +1,23 @@
+import re
+import secrets
 from dataclasses import dataclass
 from typing import Optional
 
 
+def new_job_id() -> str:
+    """Random job id: 8 hex characters, so ids can't be guessed from one another."""
+    return secrets.token_hex(4)
+
+
+# Also admits the base32 / uuid-slice ids of rows created by older builds
+_JOB_ID_RE = re.compile(r"[0-9A-Za-z]{8}")
+
+
+def is_job_id(value: str) -> bool:
+    """True if *value* has the shape of a job id (and so is safe to echo in Markdown)."""
+    return _JOB_ID_RE.fullmatch(value) is not None
+
+
 @dataclass
 class Job:
     job_id: str
@@ -1,9 +1,15 @@
 """
 Background job worker.
 
-- worker_loop()       polls SQLite for 'pending' jobs every 3 s.
+- schedule_job()      queues a job; at most JOB_WORKERS build at once. Every
+                      in-process creator calls it right after create_job.
+- worker_loop()       runs JOB_WORKERS runners that drain the job queue, and
+                      sweeps SQLite for 'pending' jobs at start-up and every
+                      60 s to pick up ones left by a crash or a full queue.
 - process_job()       runs a single Walmart cart build and fires a callback.
 - register_callback() lets the Telegram bot register a coroutine on completion.
+- set_default_callback() supplies one for jobs that finish with none registered
+  (e.g. pending jobs picked up again after a restart).
 
 Callback signature:
     async def cb(chat_id, cart_url, status, error, result) -> None
@@ -18,50 +24,120 @@ result dict (always present, even on failure):
 """
 
 import asyncio
-import json
 import logging
 import os
 import re
-
-import anthropic
-
-from db.database import get_pending_jobs, get_chat, get_items, update_job
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import orjson
+
+from agent.ai_client import ai_client
+from db.database import (
+    claim_job,
+    get_cached_queries,
+    get_chat,
+    get_items,
+    get_pending_jobs,
+    save_cached_queries,
+    update_job,
+)
 from agent.walmart import WalmartAgent, BotChallengeError
 
 logger = logging.getLogger(__name__)
 
-_callbacks: dict[str, object] = {}
+# Each cart build drives its own browser context, so these bound memory as well as load
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = 64
+SWEEP_INTERVAL = 60.0   # seconds between reconciliation sweeps
+
+
+@dataclass(slots=True)
+class JobState:
+    callback: object = None   # taken by _fire
+    scheduled: bool = False   # queued or running in this process
+
+
+class JobRegistry:
+    """Per-job bookkeeping, one entry per job_id from register/schedule until its runner ends."""
+
+    __slots__ = ("_states", "scheduled")
+
+    def __init__(self) -> None:
+        self._states: dict[str, JobState] = {}
+        self.scheduled = 0
+
+    def state(self, job_id: str) -> JobState:
+        state = self._states.get(job_id)
+        if state is None:
+            state = self._states[job_id] = JobState()
+        return state
+
+    def take_callback(self, job_id: str):
+        state = self._states.get(job_id)
+        if state is None:
+            return None
+        cb, state.callback = state.callback, None
+        return cb
+
+    def mark_scheduled(self, job_id: str) -> bool:
+        """Flag *job_id* as queued; False if it already was."""
+        state = self.state(job_id)
+        if state.scheduled:
+            return False
+        state.scheduled = True
+        self.scheduled += 1
+        return True
+
+    def unmark_scheduled(self, job_id: str) -> None:
+        """Flag *job_id* as no longer queued."""
+        state = self._states.get(job_id)
+        if state is not None and state.scheduled:
+            state.scheduled = False
+            self.scheduled -= 1
+
+    def finish(self, job_id: str) -> None:
+        """Drop *job_id* once its runner is done with it."""
+        state = self._states.pop(job_id, None)
+        if state is not None and state.scheduled:
+            self.scheduled -= 1
+
+
+_jobs = JobRegistry()
+
+# factory(job_id) → callback, for jobs whose registered callback was lost
+# with the process that registered it
+_default_callback = None
 
 _EMPTY_RESULT: dict = {"cart_url": None, "added": [], "failed": [], "screenshot": None}
 
 
-_ai_client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY", ""))
+# Normalized label → optimized query, in front of the query_cache table.
+# Staples like "eggs" or "bread" recur across carts, so most labels hit here.
+_query_cache: OrderedDict[str, str] = OrderedDict()
+_QUERY_CACHE_MAX = 4096
 
 
-async def _optimize_search_queries(items: list[dict]) -> list[dict]:
-    """
-    Use Claude Haiku to convert stored item names into optimal Walmart.ca Canada
-    search queries. Called once per cart build before the item loop.
+def _norm_label(label: str) -> str:
+    return " ".join(label.lower().split())
 
-    For example:
-        "indomie"          → "Indomie instant noodles"
-        "eggs"             → "eggs large"
-        "bread"            → "bread"
-        "3 packs indomie"  → "Indomie instant noodles"  (qty already extracted)
-    """
-    if not items:
-        return items
 
-    entries = []
-    for item in items:
-        label = f"{item['brand']} {item['name']}".strip() if item.get("brand") else item["name"]
-        entries.append(label)
+def _remember_queries(pairs: dict[str, str]) -> None:
+    for key, query in pairs.items():
+        _query_cache[key] = query
+        _query_cache.move_to_end(key)
+    while len(_query_cache) > _QUERY_CACHE_MAX:
+        _query_cache.popitem(last=False)
+
 
-    prompt = (
+# Fixed query-rewrite instructions; only the item list changes per call
+_QUERY_SYSTEM = [{
+    "type": "text",
+    "text": (
         "You are helping build a Walmart.ca Canada grocery cart. "
-        "Convert these item names into the best possible Walmart.ca search queries.\n"
+        "Convert the item names you are given (a JSON array) into the best possible "
+        "Walmart.ca search queries.\n"
         "Return ONLY a JSON array of search query strings in the same order. No explanation.\n\n"
-        "Items: " + json.dumps(entries) + "\n\n"
         "Rules:\n"
         "- Use standard grocery product names Walmart Canada would carry\n"
         "- Include brand if provided (e.g. 'Indomie instant noodles')\n"
@@ -70,57 +146,180 @@ async def _optimize_search_queries(items: list[dict]) -> list[dict]:
         "- Examples: 'indomie' → 'Indomie instant noodles', "
         "'eggs' → 'large eggs', 'bread' → 'bread', "
         "'rice' → 'long grain white rice', 'chicken' → 'chicken breast'\n"
-        "- If already a good query, keep as-is\n"
-        "Output:"
-    )
+        "- If already a good query, keep as-is"
+    ),
+    "cache_control": {"type": "ephemeral"},
+}]
+
+
+# Markdown code fence Haiku sometimes wraps the array in
+_FENCE_RE = re.compile(r"^```[a-z]*\n?")
+
+
+def _query_max_tokens(count: int) -> int:
+    """Output budget for *count* queries: ~15 tokens for ≤5 words plus JSON quoting each."""
+    return max(64, 15 * count + 32)
 
-    try:
-        resp = await _ai_client.messages.create(
-            model="claude-haiku-4-5-20251001",
-            max_tokens=300,
-            messages=[{"role": "user", "content": prompt}],
-        )
-        text = resp.content[0].text.strip()
-        text = re.sub(r"^```[a-z]*\n?", "", text).rstrip("`").strip()
-        queries = json.loads(text)
-
-        result = []
-        for i, item in enumerate(items):
-            if i < len(queries) and isinstance(queries[i], str) and queries[i].strip():
-                optimized_query = queries[i].strip()
-                new_item = dict(item)
-                # Store optimized query in name; clear brand so it isn't double-prepended
-                new_item["name"] = optimized_query
-                new_item["brand"] = None
-                result.append(new_item)
-            else:
-                result.append(item)
-
-        logger.info("Search queries optimized", extra={"count": len(result),
-                    "queries": [r["name"] for r in result]})
-        return result
 
+async def _ask_haiku(entries: list[str]) -> list:
+    """Return Haiku's search query for each label in *entries* (same order)."""
+    resp = await ai_client().messages.create(
+        model="claude-haiku-4-5-20251001",
+        max_tokens=_query_max_tokens(len(entries)),
+        system=_QUERY_SYSTEM,
+        messages=[{"role": "user", "content": orjson.dumps(entries).decode()}],
+    )
+    if resp.stop_reason == "max_tokens":
+        logger.warning("Search query reply truncated",
+                       extra={"labels": len(entries), "output_tokens": resp.usage.output_tokens})
+    text = resp.content[0].text.strip()
+    text = _FENCE_RE.sub("", text).rstrip("`").strip()
+    return orjson.loads(text)
+
+
+# Labels that concurrent cart builds still need are pooled into one Haiku call:
+# the first waits up to _BATCH_WAIT for others to join, and a full batch goes
+# out at once. Each label has one future, so overlapping jobs share its answer.
+_BATCH_WAIT = 0.5      # seconds
+_BATCH_MAX = 40        # labels per call
+_batch: dict[str, str] = {}                     # key → label, not yet sent
+_label_futures: dict[str, asyncio.Future] = {}  # key → query (None if no answer)
+_batch_timer: asyncio.TimerHandle | None = None
+_batch_tasks: set[asyncio.Task] = set()
+
+
+def _flush_batch() -> None:
+    global _batch, _batch_timer
+    if _batch_timer is not None:
+        _batch_timer.cancel()
+        _batch_timer = None
+    pending = list(_batch.items())
+    _batch = {}
+    for i in range(0, len(pending), _BATCH_MAX):
+        task = asyncio.create_task(_send_batch(dict(pending[i:i + _BATCH_MAX])))
+        _batch_tasks.add(task)
+        task.add_done_callback(_batch_tasks.discard)
+
+
+async def _send_batch(batch: dict[str, str]) -> None:
+    try:
+        queries = await _ask_haiku(list(batch.values()))
     except Exception as exc:
         logger.warning("Search query optimization failed, using originals",
-                       extra={"error": str(exc)})
+                       extra={"error": str(exc), "count": len(batch)})
+        queries = []
+    for i, key in enumerate(batch):
+        q = queries[i] if i < len(queries) else None
+        fut = _label_futures.pop(key)
+        if not fut.done():
+            fut.set_result(q.strip() if isinstance(q, str) and q.strip() else None)
+
+
+async def _ask_haiku_batched(missing: dict[str, str]) -> dict[str, str]:
+    """Queries for *missing* (key → label), fetched alongside other jobs' labels."""
+    global _batch_timer
+    loop = asyncio.get_running_loop()
+    futures = {}
+    for key, label in missing.items():
+        fut = _label_futures.get(key)
+        if fut is None:
+            fut = _label_futures[key] = loop.create_future()
+            _batch[key] = label
+        futures[key] = fut
+
+    if len(_batch) >= _BATCH_MAX:
+        _flush_batch()
+    elif _batch and _batch_timer is None:
+        _batch_timer = loop.call_later(_BATCH_WAIT, _flush_batch)
+
+    # Shielded: a cancelled job must not cancel answers other jobs share
+    answers = await asyncio.gather(*map(asyncio.shield, futures.values()))
+    return {key: q for key, q in zip(futures, answers) if q}
+
+
+async def _optimize_search_queries(items: list[dict]) -> list[dict]:
+    """
+    Use Claude Haiku to convert stored item names into optimal Walmart.ca Canada
+    search queries. Called once per cart build before the item loop.
+
+    For example:
+        "indomie"          → "Indomie instant noodles"
+        "eggs"             → "eggs large"
+        "bread"            → "bread"
+        "3 packs indomie"  → "Indomie instant noodles"  (qty already extracted)
+
+    Answers are cached per normalized label, in process and in the
+    query_cache table; only labels missing from both are sent to Haiku.
+    """
+    if not items:
         return items
 
+    labels = [
+        f"{item['brand']} {item['name']}".strip() if item.get("brand") else item["name"]
+        for item in items
+    ]
+    keys = [_norm_label(label) for label in labels]
+
+    known = {k: _query_cache[k] for k in keys if k in _query_cache}
+    missing = {k: label for k, label in zip(keys, labels) if k not in known}
+    if missing:
+        # The cache only saves work; a DB error falls through to Haiku
+        try:
+            stored = await get_cached_queries(list(missing))
+        except Exception as exc:
+            logger.warning("Query cache read failed", extra={"error": str(exc)})
+            stored = {}
+        _remember_queries(stored)
+        known.update(stored)
+        missing = {k: label for k, label in missing.items() if k not in stored}
+
+    if missing:
+        fresh = await _ask_haiku_batched(missing)
+        if fresh:
+            _remember_queries(fresh)
+            known.update(fresh)
+            try:
+                await save_cached_queries(fresh)
+            except Exception as exc:
+                logger.warning("Query cache write failed", extra={"error": str(exc)})
+
+    result = []
+    for item, key in zip(items, keys):
+        query = known.get(key)
+        if query:
+            new_item = dict(item)
+            # Store optimized query in name; clear brand so it isn't double-prepended
+            new_item["name"] = query
+            new_item["brand"] = None
+            result.append(new_item)
+        else:
+            result.append(item)
+
+    logger.info("Search queries optimized", extra={"count": len(result),
+                "asked": len(missing), "queries": [r["name"] for r in result]})
+    return result
+
 
 def register_callback(job_id: str, cb) -> None:
-    _callbacks[job_id] = cb
+    _jobs.state(job_id).callback = cb
+
+
+def set_default_callback(factory) -> None:
+    """Set factory(job_id) -> callback, used when no callback is registered."""
+    global _default_callback
+    _default_callback = factory
 
 
 async def process_job(job: dict) -> None:
+    """Build the cart for *job*, which the caller has already claimed (see claim_job)."""
     job_id = job["job_id"]
     chat_id = job["chat_id"]
 
-    await update_job(job_id, "running")
     logger.info("Job started", extra={"job_id": job_id, "chat_id": chat_id})
 
-    chat = await get_chat(chat_id)
+    chat, item_rows = await asyncio.gather(get_chat(chat_id), get_items(chat_id))
     postal_code = chat["postal_code"] if chat else ""
 
-    item_rows = await get_items(chat_id)
     if not item_rows:
         await update_job(job_id, "failed", error="No items in list")
         await _fire(job_id, chat_id, None, "failed", "No items in list", _EMPTY_RESULT)
@@ -139,68 +338,73 @@ async def process_job(job: dict) -> None:
     # Try up to 2 attempts:
     #   Attempt 1 — normal headless run
     #   Attempt 2 — after silent headful session refresh (if attempt 1 was blocked)
+    # Rewrite the search queries once, while the first browser context opens;
+    # attempt 2 awaits the same finished task
+    optimize = asyncio.create_task(_optimize_search_queries(items))
     for attempt in range(1, 3):
-        items_run = await _optimize_search_queries(items)
+        try:
+            async with WalmartAgent(postal_code=postal_code) as agent:
+                items_run = await optimize
+                try:
+                    result = await agent.build_cart(items_run, job_id=job_id)
 
-        async with WalmartAgent(postal_code=postal_code) as agent:
-            try:
-                result = await agent.build_cart(items_run, job_id=job_id)
-
-                await update_job(job_id, "done", result_url=result["cart_url"])
-                logger.info(
-                    "Job done",
-                    extra={
-                        "job_id":   job_id,
-                        "attempt":  attempt,
-                        "added":    len(result["added"]),
-                        "failed":   len(result["failed"]),
-                        "cart_url": result["cart_url"],
-                    },
-                )
-                await _fire(job_id, chat_id, result["cart_url"], "done", result=result)
-                return  # success — stop here
-
-            except BotChallengeError as exc:
-                screenshot = agent.last_screenshot
-                logger.warning(
-                    "Bot challenge on attempt %d/%d",
-                    attempt, 2,
-                    extra={"job_id": job_id, "error": str(exc)},
-                )
-
-                if attempt == 1:
-                    # First block — silently open headful Firefox to get fresh
-                    # Akamai cookies, then loop and retry headlessly.
+                    await update_job(job_id, "done", result_url=result["cart_url"])
                     logger.info(
-                        "Auto-refreshing session with headful Firefox...",
-                        extra={"job_id": job_id},
+                        "Job done",
+                        extra={
+                            "job_id":   job_id,
+                            "attempt":  attempt,
+                            "added":    len(result["added"]),
+                            "failed":   len(result["failed"]),
+                            "cart_url": result["cart_url"],
+                        },
+                    )
+                    await _fire(job_id, chat_id, result["cart_url"], "done", result=result)
+                    return  # success — stop here
+
+                except BotChallengeError as exc:
+                    screenshot = agent.last_screenshot
+                    logger.warning(
+                        "Bot challenge on attempt %d/%d",
+                        attempt, 2,
+                        extra={"job_id": job_id, "error": str(exc)},
                     )
-                    from agent.walmart import refresh_session_headful
-                    refreshed = await refresh_session_headful()
-                    if refreshed:
+
+                    if attempt == 1:
+                        # First block — silently open headful Firefox to get fresh
+                        # Akamai cookies, then loop and retry headlessly.
                         logger.info(
-                            "Session refreshed — retrying cart build",
+                            "Auto-refreshing session with headful Firefox...",
                             extra={"job_id": job_id},
                         )
-                        continue  # go to attempt 2
-
-                # Attempt 2 also blocked, or headful refresh itself failed
-                msg = "Walmart needs verification"
-                await update_job(job_id, "needs_user", error=msg, screenshot=screenshot)
-                result_data = {**_EMPTY_RESULT, "screenshot": screenshot}
-                await _fire(job_id, chat_id, None, "needs_user", msg, result_data)
-                return
-
-            except Exception as exc:
-                screenshot = agent.last_screenshot
-                msg = str(exc)
-                logger.error(
-                    "Job failed", extra={"job_id": job_id, "error": msg}, exc_info=True
-                )
-                await update_job(job_id, "failed", error=msg, screenshot=screenshot)
-                result_data = {**_EMPTY_RESULT, "screenshot": screenshot}
-                await _fire(job_id, chat_id, None, "failed", msg, result_data)
-                return
+                        from agent.walmart import refresh_session_headful
+                        refreshed = await refresh_session_headful()
+                        if refreshed:
+                            logger.info(
+                                "Session refreshed — retrying cart build",
+                                extra={"job_id": job_id},
+                            )
+                            continue  # go to attempt 2
+
+                    # Attempt 2 also blocked, or headful refresh itself failed
+                    msg = "Walmart needs verification"
+                    await update_job(job_id, "needs_user", error=msg, screenshot=screenshot)
+                    result_data = {**_EMPTY_RESULT, "screenshot": screenshot}
+                    await _fire(job_id, chat_id, None, "needs_user", msg, result_data)
+                    return
+
+                except Exception as exc:
+                    screenshot = agent.last_screenshot
+                    msg = str(exc)
+                    logger.error(
+                        "Job failed", extra={"job_id": job_id, "error": msg}, exc_info=True
+                    )
+                    await update_job(job_id, "failed", error=msg, screenshot=screenshot)
+                    result_data = {**_EMPTY_RESULT, "screenshot": screenshot}
+                    await _fire(job_id, chat_id, None, "failed", msg, result_data)
+                    return
+        finally:
+            optimize.cancel()   # no-op once done; stops it if the agent failed to open
 
 
 async def _fire(
@@ -211,7 +415,9 @@ async def _fire(
     error: str | None = None,
     result: dict | None = None,
 ) -> None:
-    cb = _callbacks.pop(job_id, None)
+    cb = _jobs.take_callback(job_id)
+    if cb is None and _default_callback is not None:
+        cb = _default_callback(job_id)
     if cb:
         try:
             await cb(chat_id, cart_url, status, error, result or _EMPTY_RESULT)
@@ -219,32 +425,92 @@ async def _fire(
             logger.error("Callback error", extra={"job_id": job_id, "error": str(exc)})
 
 
-_running: set[str] = set()
+# Jobs waiting for a runner. _jobs flags the ids queued or running, so a
+# sweep doesn't queue a job twice; claim_job is what guarantees a single run.
+_job_queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+
+# Set once a job had to be deferred and a runner has since freed a queue slot,
+# so worker_loop sweeps straight away instead of at the next interval
+_sweep_now = asyncio.Event()
+_deferred = False
 
 
 def schedule_job(job: dict) -> None:
-    """Start a job task, guarded by _running to prevent duplicate execution."""
+    """
+    Queue a job unless it is already queued or running.
+
+    When the queue is full the job is left 'pending' in the DB; worker_loop
+    offers it again as soon as a runner frees a slot.
+    """
+    global _deferred
     jid = job["job_id"]
-    if jid in _running:
+    if not _jobs.mark_scheduled(jid):
         return
-    _running.add(jid)
+    try:
+        _job_queue.put_nowait(job)
+    except asyncio.QueueFull:
+        _jobs.unmark_scheduled(jid)
+        logger.warning("Job queue full, deferring", extra={"job_id": jid})
+        _deferred = True
 
-    async def _run() -> None:
-        try:
-            await process_job(job)
-        finally:
-            _running.discard(jid)
 
-    asyncio.create_task(_run())
+async def _fail_crashed(job: dict, exc: Exception) -> None:
+    """Mark a claimed job that crashed as failed and tell its chat, so it isn't left 'running'."""
+    job_id = job["job_id"]
+    msg = f"Cart build crashed: {exc}"
+    try:
+        await update_job(job_id, "failed", error=msg)
+    except Exception as db_exc:
+        logger.error("Could not mark crashed job failed",
+                     extra={"job_id": job_id, "error": str(db_exc)})
+    await _fire(job_id, job["chat_id"], None, "failed", msg)
 
 
-async def worker_loop() -> None:
-    logger.info("Job worker started")
+async def _job_runner() -> None:
     while True:
+        job = await _job_queue.get()
+        if _deferred:
+            _sweep_now.set()
+        claimed = False
         try:
-            for job in await get_pending_jobs():
-                schedule_job(job)
+            claimed = await claim_job(job["job_id"])
+            if claimed:
+                await process_job(job)
         except Exception as exc:
-            logger.error("worker_loop error", extra={"error": str(exc)}, exc_info=True)
+            logger.error("Job crashed", extra={"job_id": job["job_id"], "error": str(exc)},
+                         exc_info=True)
+            if claimed:
+                await _fail_crashed(job, exc)
+        finally:
+            _jobs.finish(job["job_id"])
+            _job_queue.task_done()
 
-        await asyncio.sleep(3)
+
+async def worker_loop() -> None:
+    global _deferred
+    logger.info("Job worker started", extra={"workers": JOB_WORKERS})
+    runners = [
+        asyncio.create_task(_job_runner(), name=f"job-runner-{i}")
+        for i in range(JOB_WORKERS)
+    ]
+    try:
+        while True:
+            _sweep_now.clear()
+            _deferred = False
+            # Fetch no more than the queue can take; the already-queued ids are
+            # added because they are among the oldest pending rows
+            free = _job_queue.maxsize - _job_queue.qsize()
+            try:
+                if free:
+                    for job in await get_pending_jobs(limit=free + _jobs.scheduled):
+                        schedule_job(job)
+            except Exception as exc:
+                logger.error("worker_loop error", extra={"error": str(exc)}, exc_info=True)
+
+            try:
+                await asyncio.wait_for(_sweep_now.wait(), SWEEP_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for runner in runners:
+            runner.cancel()